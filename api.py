@@ -1,18 +1,38 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-import subprocess
-import shutil
 import os
 import uuid
-import tempfile
 from pathlib import Path
 import psutil
 import json
-from typing import Optional
-from database import User, init_db, get_db
+import csv
+import io
+import re
+import asyncio
+from typing import Optional, Tuple
+from datetime import datetime
+from database import User, Job, Run, Upload, UploadPart, SessionLocal, init_db, get_db
+from scheduler import (
+    PipelineScheduler, queue_position, MAX_CONCURRENT_RUNS, RUNNING, FINISHED_STATES, PREVIEW_STAGE
+)
+from run_status import run_status, reused_tasks, sample_progress
+from report_manifest import (
+    ManifestCache, build_manifest, read_manifest, write_manifest, run_samples, sample_reports
+)
+from store import BlobStore
+from resources import RESOURCE_PROFILES, AUTO, resource_args
+from ref_index import (
+    IndexBuildError, DEFAULT_PRESET, minimap2_version, index_key, index_info, file_sha256,
+    list_indexes, claim_build, build_index, remove_index
+)
+from uploads import (
+    UploadError, receive_stream, receive_staged, upload_chunks, discard,
+    DEFAULT_PART_SIZE, MAX_PART_SIZE, part_count, part_length, preallocate, receive_part, verify_file
+)
+from starlette.concurrency import run_in_threadpool
 from auth import hash_password, verify_password, create_access_token, verify_token
 
 # -------------------------------------------------
@@ -24,8 +44,25 @@ DATA_TEST_DIR = os.path.join(BASE_DIR, "data_test")
 REF_TEST_DIR  = os.path.join(BASE_DIR, "ref_test")
 RESULTS_DIR   = Path(BASE_DIR) / "results_test"
 
+STORE_DIR     = os.path.join(BASE_DIR, "store")
+INDEX_CACHE_DIR = os.path.join(BASE_DIR, "ref_index_cache")
+
 PIPELINE = os.path.join(BASE_DIR, "main.nf")
 
+# Nextflow profiles per publishing policy: "copy" publishes full copies of every
+# output; "lean" hardlinks large outputs, skips intermediates and cleans work/
+# (which removes the cached tasks -resume reuses, so it needs resume=false)
+PUBLISH_POLICIES = {"copy": "test", "lean": "test,lean"}
+
+# FASTQ QC engines: falco reports evaluated by summary.py, or fastq_qc.py
+QC_ENGINES = ("falco", "native")
+
+# summary.py runs: once per sample, or once for the whole run (main.nf QC_SUMMARY_ALL)
+SUMMARY_MODES = ("per_sample", "aggregate")
+
+# Read pairs per sample a preview run looks at (see run_pipeline)
+PREVIEW_READS = 100_000
+
 os.makedirs(DATA_TEST_DIR, exist_ok=True)
 os.makedirs(REF_TEST_DIR, exist_ok=True)
 os.makedirs(RESULTS_DIR, exist_ok=True)
@@ -38,6 +75,25 @@ app = FastAPI(title="Variant Calling Pipeline API")
 # Initialize database
 init_db()
 
+# Deduplicated, refcounted uploads (see store.py)
+store = BlobStore(STORE_DIR)
+
+# Bounded run queue (see scheduler.py)
+scheduler = PipelineScheduler(max_concurrent=MAX_CONCURRENT_RUNS, cwd=BASE_DIR)
+
+# Report listings of finished runs (see report_manifest.py)
+manifests = ManifestCache()
+
+
+@app.on_event("startup")
+def start_scheduler():
+    scheduler.start()
+
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    scheduler.stop()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -47,9 +103,28 @@ app.add_middleware(
 )
 
 # -------------------------------------------------
-# JOB REGISTRY (IN-MEMORY, STEP-2 SCOPE)
+# JOB REGISTRY (SQLITE, SHARED BY ALL API WORKERS)
 # -------------------------------------------------
-JOBS = {}
+def get_run(db: Session, job_id: str, iteration: int) -> Run:
+    """Look up a run by primary key, 404ing on unknown jobs or iterations"""
+    if db.get(Job, job_id) is None:
+        raise HTTPException(status_code=404, detail="Invalid job_id")
+
+    run = db.get(Run, (job_id, iteration))
+    if run is None:
+        raise HTTPException(status_code=404, detail="Invalid iteration")
+    return run
+
+
+def run_reuse(db: Session, run: Run) -> dict:
+    """Tasks of `run` resumed from an earlier iteration of its job (see run_status.py)"""
+    earlier = db.query(Run).filter(Run.job_id == run.job_id, Run.iteration < run.iteration).all()
+    return reused_tasks(run, earlier)
+
+
+def run_outdirs(db: Session, job_id: str):
+    """iteration -> outdir lookup for the runs of a job"""
+    return lambda iteration: Path(get_run(db, job_id, iteration).outdir)
 
 # -------------------------------------------------
 # PYDANTIC MODELS
@@ -165,38 +240,83 @@ def health():
 # -------------------------------------------------
 # UPLOAD READS
 # -------------------------------------------------
+async def adopt_staged(db: Session, files: list) -> list:
+    """store.adopt_all for (staged path, sha256, name) files. Runs in the
+    threadpool, since a store on another filesystem means copying each file;
+    the staged files are discarded if it fails."""
+    try:
+        return await run_in_threadpool(store.adopt_all, db, files)
+    except BaseException:
+        for path, _, _ in files:
+            await run_in_threadpool(discard, path)
+        raise
+
+
 @app.post("/upload-reads")
 async def upload_reads(
     sample: str = Form(...),
     r1: UploadFile = File(...),
-    r2: UploadFile = File(...)
+    r2: UploadFile = File(...),
+    db: Session = Depends(get_db)
 ):
     r1_path = os.path.join(DATA_TEST_DIR, f"{sample}_1.fastq.gz")
     r2_path = os.path.join(DATA_TEST_DIR, f"{sample}_2.fastq.gz")
 
     os.makedirs(DATA_TEST_DIR, exist_ok=True)
 
-
+    # Both mates are hashed and gzip-checked into staged files; they replace
+    # the pair's names together, and only once both are intact
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as t1:
-            shutil.copyfileobj(r1.file, t1)
-        with tempfile.NamedTemporaryFile(delete=False) as t2:
-            shutil.copyfileobj(r2.file, t2)
-
-        shutil.move(t1.name, r1_path)
-        shutil.move(t2.name, r2_path)
-
+        r1_info, r2_info = await receive_staged([
+            (upload_chunks(r1), r1_path),
+            (upload_chunks(r2), r2_path),
+        ])
+    except UploadError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    adopted = await adopt_staged(db, [
+        (r1_info["path"], r1_info["sha256"], r1_path),
+        (r2_info["path"], r2_info["sha256"], r2_path),
+    ])
+    r1_info.update(adopted[0], path=r1_path)
+    r2_info.update(adopted[1], path=r2_path)
+
     pattern = os.path.join(DATA_TEST_DIR, f"{sample}_{{1,2}}.fastq.gz")
-    return {"sample": sample, "files": [r1_path, r2_path], "pattern": pattern}
+    return {
+        "sample": sample,
+        "files": [r1_path, r2_path],
+        "pattern": pattern,
+        "checksums": {"r1": r1_info, "r2": r2_info}
+    }
+
+
+@app.put("/upload-reads/{sample}/{mate}")
+async def upload_read_stream(sample: str, mate: int, request: Request, sha256: Optional[str] = None,
+                             db: Session = Depends(get_db)):
+    """Stream one mate as the raw request body straight into data_test.
+    Send R1 and R2 as two concurrent requests; pass `sha256` to have the
+    upload verified."""
+    if mate not in (1, 2):
+        raise HTTPException(400, "mate must be 1 or 2")
+
+    path = os.path.join(DATA_TEST_DIR, f"{sample}_{mate}.fastq.gz")
+    try:
+        info = await receive_stream(request.stream(), path, expected_sha256=sha256, staged=True)
+    except UploadError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    [adopted] = await adopt_staged(db, [(info["path"], info["sha256"], path)])
+    info.update(adopted, path=path)
+
+    pattern = os.path.join(DATA_TEST_DIR, f"{sample}_{{1,2}}.fastq.gz")
+    return {"sample": sample, "mate": mate, "pattern": pattern, **info}
 
 # -------------------------------------------------
 # UPLOAD REFERENCE
 # -------------------------------------------------
 @app.post("/upload-ref")
-async def upload_reference(fasta: UploadFile = File(...)):
+async def upload_reference(fasta: UploadFile = File(...), db: Session = Depends(get_db)):
     if not fasta.filename.endswith((".fa", ".fna", ".fasta")):
         raise HTTPException(400, "Invalid reference format")
 
@@ -204,25 +324,301 @@ async def upload_reference(fasta: UploadFile = File(...)):
 
     os.makedirs(REF_TEST_DIR, exist_ok=True)
 
+    try:
+        info = await receive_stream(upload_chunks(fasta), ref_path, gzip_check=False, staged=True)
+    except UploadError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not info["size"]:
+        await run_in_threadpool(discard, info["path"])
+        raise HTTPException(status_code=422, detail="Empty reference")
+    [adopted] = await adopt_staged(db, [(info["path"], info["sha256"], ref_path)])
+    info.update(adopted)
+    return {"reference": ref_path, "sha256": info["sha256"], "deduplicated": info["deduplicated"]}
+
+# -------------------------------------------------
+# RESUMABLE UPLOADS (INITIATE / PART / STATUS / COMPLETE)
+# -------------------------------------------------
+def get_upload(db: Session, upload_id: str) -> Upload:
+    upload = db.get(Upload, upload_id)
+    if upload is None:
+        raise HTTPException(404, "Invalid upload_id")
+    return upload
+
+
+def upload_status(db: Session, upload: Upload) -> dict:
+    parts = db.query(UploadPart).filter(UploadPart.upload_id == upload.upload_id).all()
+    received = sorted(part.part_number for part in parts)
+    total = part_count(upload.size, upload.part_size)
+    received_set = set(received)
+    return {
+        "upload_id": upload.upload_id,
+        "path": upload.dest,
+        "state": upload.state,
+        "size": upload.size,
+        "part_size": upload.part_size,
+        "part_count": total,
+        "received": received,
+        "missing": [n for n in range(1, total + 1) if n not in received_set],
+        "bytes_received": sum(part.size for part in parts),
+    }
+
+
+@app.post("/uploads")
+def initiate_upload(
+    kind: str = Form(...),
+    size: int = Form(...),
+    sample: Optional[str] = Form(None),
+    mate: Optional[int] = Form(None),
+    filename: Optional[str] = Form(None),
+    part_size: int = Form(DEFAULT_PART_SIZE),
+    sha256: Optional[str] = Form(None),
+    db: Session = Depends(get_db),
+):
+    """Start a resumable upload of a read file (kind=reads, sample, mate) or
+    a reference (kind=ref, filename). Parts are then PUT in any order, in
+    parallel, into a file preallocated next to the final path. Content already
+    in the store is deduplicated on completion, once the server has hashed it
+    (a client-supplied `sha256` is only checked, never trusted)."""
+    if kind == "reads":
+        if not sample or mate not in (1, 2):
+            raise HTTPException(400, "reads uploads need sample and mate (1 or 2)")
+        dest = os.path.join(DATA_TEST_DIR, f"{sample}_{mate}.fastq.gz")
+        gzip_check = True
+    elif kind == "ref":
+        if not filename or not filename.endswith((".fa", ".fna", ".fasta")):
+            raise HTTPException(400, "Invalid reference format")
+        dest = os.path.join(REF_TEST_DIR, os.path.basename(filename))
+        gzip_check = False
+    else:
+        raise HTTPException(400, "kind must be 'reads' or 'ref'")
+
+    if size < 0 or not 0 < part_size <= MAX_PART_SIZE:
+        raise HTTPException(400, "Invalid size or part_size")
+    if kind == "ref" and size == 0:
+        raise HTTPException(400, "Empty reference")
+
+    upload_id = str(uuid.uuid4())
+    tmp_path = f"{dest}.upload-{upload_id}"
+
+    preallocate(tmp_path, size)
+
+    upload = Upload(
+        upload_id=upload_id,
+        dest=dest,
+        tmp_path=tmp_path,
+        size=size,
+        part_size=part_size,
+        sha256=sha256,
+        gzip_check=gzip_check,
+        state="uploading"
+    )
+    db.add(upload)
+    db.commit()
+    return upload_status(db, upload)
+
+
+@app.put("/uploads/{upload_id}/parts/{part_number}")
+async def upload_part(upload_id: str, part_number: int, request: Request, db: Session = Depends(get_db)):
+    """Write one 1-based part (raw body) at its offset. Re-sending a part is safe."""
+    upload = get_upload(db, upload_id)
+    if upload.state != "uploading":
+        raise HTTPException(409, f"Upload already {upload.state}")
+    if not 1 <= part_number <= part_count(upload.size, upload.part_size):
+        raise HTTPException(400, "Invalid part_number")
+
+    offset = (part_number - 1) * upload.part_size
+    length = part_length(upload.size, upload.part_size, part_number)
+    try:
+        digest = await receive_part(request.stream(), upload.tmp_path, offset, length)
+    except BaseException as e:
+        # The part's byte range may now be partly overwritten: forget it
+        db.query(UploadPart).filter(
+            UploadPart.upload_id == upload_id, UploadPart.part_number == part_number
+        ).delete()
+        db.commit()
+        if isinstance(e, UploadError):
+            raise HTTPException(status_code=422, detail=str(e))
+        raise
+
+    db.merge(UploadPart(upload_id=upload_id, part_number=part_number, size=length, sha256=digest))
+    db.commit()
+    return {"upload_id": upload_id, "part_number": part_number, "size": length, "sha256": digest}
+
+
+@app.get("/uploads/{upload_id}")
+def get_upload_status(upload_id: str, db: Session = Depends(get_db)):
+    """Which parts have arrived, so an interrupted client can resume"""
+    return upload_status(db, get_upload(db, upload_id))
+
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, db: Session = Depends(get_db)):
+    """Verify the assembled file (checksum, gzip integrity) and rename it
+    into place; the parts were written in place, so nothing is copied."""
+    upload = get_upload(db, upload_id)
+
+    # Claim the upload (one conditional UPDATE, like the scheduler's claim) so
+    # concurrent completes cannot both verify and rename it
+    claimed = db.query(Upload).filter(
+        Upload.upload_id == upload_id, Upload.state == "uploading"
+    ).update({Upload.state: "completing"})
+    db.commit()
+    db.refresh(upload)
+    if not claimed:
+        raise HTTPException(409, f"Upload already {upload.state}")
+
+    try:
+        status = upload_status(db, upload)
+        if status["missing"]:
+            raise HTTPException(409, {"message": "Missing parts", "missing": status["missing"]})
+
+        info = await run_in_threadpool(verify_file, upload.tmp_path, upload.gzip_check)
+        if upload.sha256 and upload.sha256.lower() != info["sha256"]:
+            raise UploadError(f"SHA-256 mismatch: expected {upload.sha256}, got {info['sha256']}")
+        if not upload.gzip_check and not info["size"]:
+            raise UploadError("Empty reference")
+
+        upload.state = "complete"
+        upload.completed_at = datetime.utcnow()
+        # The assembled file goes straight from its temp path into the store;
+        # the state change is committed together with the new ref
+        info.update(await run_in_threadpool(store.adopt, db, upload.tmp_path, info["sha256"], upload.dest))
+        info["path"] = upload.dest
+    except BaseException as e:
+        # Back to "uploading" whatever failed (adopt() leaves the assembled
+        # file in place), so the client can fix the parts and retry
+        db.rollback()
+        upload.state = "uploading"
+        upload.completed_at = None
+        db.commit()
+        if isinstance(e, UploadError):
+            raise HTTPException(status_code=422, detail=str(e))
+        raise
+
+    result = {"upload_id": upload_id, "path": upload.dest, **info}
+    if upload.dest.startswith(DATA_TEST_DIR):
+        sample = os.path.basename(upload.dest).rsplit("_", 1)[0]
+        result["pattern"] = os.path.join(DATA_TEST_DIR, f"{sample}_{{1,2}}.fastq.gz")
+    return result
+
+# -------------------------------------------------
+# INPUT STORE
+# -------------------------------------------------
+@app.get("/store")
+def get_store_stats(db: Session = Depends(get_db)):
+    return store.stats(db)
+
+
+@app.post("/store/gc")
+def collect_store_garbage(db: Session = Depends(get_db)):
+    """Unpin inputs of finished runs and delete content no name or run uses"""
+    return store.gc(db)
+
+# -------------------------------------------------
+# REFERENCE INDEX CACHE (see ref_index.py)
+# -------------------------------------------------
+@app.get("/ref-index")
+def get_ref_indexes():
+    """minimap2 indexes that full runs will reuse instead of running INDEX_REF"""
+    return {"cache_dir": INDEX_CACHE_DIR, "indexes": list_indexes(INDEX_CACHE_DIR)}
+
+
+@app.post("/ref-index")
+async def prebuild_ref_index(
+    background_tasks: BackgroundTasks,
+    ref_path: str = Form(...),
+    preset: str = Form(DEFAULT_PRESET),
+    db: Session = Depends(get_db),
+):
+    """Build the index for a reference ahead of its first full run. Returns
+    at once; poll GET /ref-index until the entry is "ready"."""
+    if not os.path.isfile(ref_path):
+        raise HTTPException(404, "Reference not found")
+    try:
+        version = minimap2_version()
+    except IndexBuildError as e:
+        raise HTTPException(503, str(e))
+
+    ref_sha256 = store.sha_of(db, ref_path) or await run_in_threadpool(file_sha256, ref_path)
+    key = index_key(ref_sha256, preset, version)
+    if index_info(INDEX_CACHE_DIR, key)["state"] != "ready" and claim_build(key):
+        background_tasks.add_task(build_index, INDEX_CACHE_DIR, key, ref_path, ref_sha256, preset)
+    return index_info(INDEX_CACHE_DIR, key)
 
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        shutil.copyfileobj(fasta.file, tmp)
 
-    shutil.move(tmp.name, ref_path)
-    return {"reference": ref_path}
+@app.delete("/ref-index/{key}")
+def delete_ref_index(key: str):
+    if not remove_index(INDEX_CACHE_DIR, key):
+        raise HTTPException(404, "Invalid index key")
+    return {"key": key, "removed": True}
 
 # -------------------------------------------------
 # CREATE JOB
 # -------------------------------------------------
 @app.post("/jobs")
-def create_job():
+def create_job(db: Session = Depends(get_db)):
     job_id = str(uuid.uuid4())
-    JOBS[job_id] = {"iterations": 0, "runs": {}}
+    db.add(Job(job_id=job_id, iterations=0))
+    db.commit()
     return {"job_id": job_id}
 
 # -------------------------------------------------
 # RUN PIPELINE (ITERATION-AWARE)
 # -------------------------------------------------
+SAMPLESHEET_FILE = "samplesheet.csv"
+SAMPLESHEET_COLUMNS = ("sample", "fastq_1", "fastq_2")
+SAMPLE_NAME = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+def parse_samplesheet(text: str) -> list:
+    """Validated rows of a sample sheet; relative paths are taken from the repo root"""
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not set(SAMPLESHEET_COLUMNS) <= set(reader.fieldnames):
+        raise HTTPException(400, f"samplesheet needs the columns {', '.join(SAMPLESHEET_COLUMNS)}")
+
+    samples = []
+    seen = set()
+    # Reports are named after the FASTQ file names, so two samples' files
+    # sharing a name would overwrite each other's reports
+    file_names = set()
+    for line, row in enumerate(reader, start=2):
+        sample = (row["sample"] or "").strip()
+        if not SAMPLE_NAME.match(sample):
+            raise HTTPException(400, f"samplesheet line {line}: invalid sample name {sample!r}")
+        if sample in seen:
+            raise HTTPException(400, f"samplesheet line {line}: duplicate sample {sample}")
+        seen.add(sample)
+
+        entry = {"sample": sample}
+        for key in ("fastq_1", "fastq_2"):
+            path = os.path.join(BASE_DIR, (row[key] or "").strip())
+            if not os.path.isfile(path):
+                raise HTTPException(400, f"samplesheet line {line}: {key} not found")
+            if os.path.basename(path) in file_names:
+                raise HTTPException(400, f"samplesheet line {line}: duplicate file name {os.path.basename(path)}")
+            file_names.add(os.path.basename(path))
+            entry[key] = path
+        samples.append(entry)
+
+    if not samples:
+        raise HTTPException(400, "samplesheet has no samples")
+    return samples
+
+
+def write_samplesheet(path: Path, samples: list) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SAMPLESHEET_COLUMNS)
+        writer.writeheader()
+        writer.writerows(samples)
+
+
+def read_samplesheet(path: Path) -> list:
+    if not path.exists():
+        return []
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
 @app.post("/jobs/{job_id}/run")
 def run_pipeline(
     job_id: str,
@@ -231,165 +627,424 @@ def run_pipeline(
     min_len: int = Form(36),
     reads_pattern: Optional[str] = Form(None),
     ref_path: Optional[str] = Form(None),
+    priority: int = Form(0),
+    resume: bool = Form(True),
+    preset: str = Form(DEFAULT_PRESET),
+    shard_size: int = Form(0),
+    fused_align: bool = Form(False),
+    markdup: bool = Form(True),
+    publish_policy: str = Form("copy"),
+    resources: str = Form(AUTO),
+    qc_engine: str = Form("falco"),
+    skip_trimmed_qc: bool = Form(False),
+    summary_mode: str = Form("per_sample"),
+    preview_reads: int = Form(0),
+    samplesheet: Optional[UploadFile] = File(None),
+    db: Session = Depends(get_db),
 ):
-    if job_id not in JOBS:
+    """Queue an iteration of a job. Reads come from `reads_pattern`, or from
+    a `samplesheet` CSV (sample,fastq_1,fastq_2) to run a whole cohort in one
+    Nextflow session; progress per sample is at /jobs/{job_id}/samples/{iteration}.
+
+    With `preview_reads`, a "preview" iteration is queued as well: QC of the
+    first `preview_reads` read pairs of each sample, which runs next to the
+    full run and reports estimated verdicts within seconds."""
+    if db.get(Job, job_id) is None:
         raise HTTPException(404, "Invalid job_id")
 
-    if stage not in ["qc_only", "trim_qc", "full"]:
+    samples = None
+    if samplesheet is not None:
+        if reads_pattern:
+            raise HTTPException(400, "Give either reads_pattern or samplesheet")
+        samples = parse_samplesheet(samplesheet.file.read().decode("utf-8-sig"))
+
+    if stage not in [PREVIEW_STAGE, "qc_only", "trim_qc", "full"]:
         raise HTTPException(400, "Invalid stage")
 
-    JOBS[job_id]["iterations"] += 1
-    iteration = JOBS[job_id]["iterations"]
+    if publish_policy not in PUBLISH_POLICIES:
+        raise HTTPException(400, f"publish_policy must be one of {', '.join(PUBLISH_POLICIES)}")
+
+    if publish_policy == "lean" and resume:
+        raise HTTPException(400, "publish_policy lean cleans the work dir -resume reuses; set resume=false")
+
+    if resources != AUTO and resources not in RESOURCE_PROFILES:
+        raise HTTPException(400, f"resources must be {AUTO} or one of {', '.join(RESOURCE_PROFILES)}")
+
+    if qc_engine not in QC_ENGINES:
+        raise HTTPException(400, f"qc_engine must be one of {', '.join(QC_ENGINES)}")
+
+    # Post-trim QC from fastp's JSON replaces the falco pass over trimmed reads
+    if skip_trimmed_qc and qc_engine != "falco":
+        raise HTTPException(400, "skip_trimmed_qc only applies to the falco qc_engine")
 
-    outdir = RESULTS_DIR / f"job_{job_id}" / f"iter_{iteration}_{stage}"
-    outdir.mkdir(parents=True, exist_ok=True)
+    if summary_mode not in SUMMARY_MODES:
+        raise HTTPException(400, f"summary_mode must be one of {', '.join(SUMMARY_MODES)}")
 
-    log_file = outdir / "pipeline.log"
+    if shard_size and shard_size < 250:
+        raise HTTPException(400, "shard_size must be 0 (off) or at least 250 read pairs")
 
-    cmd = [
-        "nextflow", "run", PIPELINE,
-        "-profile", "test",
-        "--stage", stage,
-        "--qual", str(qual),
-        "--min_len", str(min_len),
-        "--outdir", str(outdir)
-    ]
+    if preview_reads < 0:
+        raise HTTPException(400, "preview_reads must be 0 (no preview) or a number of read pairs")
+    if stage == PREVIEW_STAGE:
+        preview_reads = preview_reads or PREVIEW_READS
 
+    # Nextflow runs from the job's launch dir: anchor relative inputs here
     if reads_pattern:
-        cmd.extend(["--reads", reads_pattern])
-    
+        reads_pattern = os.path.join(BASE_DIR, reads_pattern)
     if ref_path:
-        cmd.extend(["--ref", ref_path])
+        ref_path = os.path.join(BASE_DIR, ref_path)
+
+    # Known for store-managed references, so INDEX_REF can skip hashing
+    ref_sha256 = store.sha_of(db, ref_path) if ref_path else None
+
+    def queue(run_stage: str) -> Tuple[Run, str]:
+        # Atomic increment so concurrent workers never hand out the same iteration
+        db.query(Job).filter(Job.job_id == job_id).update({Job.iterations: Job.iterations + 1})
+        iteration = db.query(Job.iterations).filter(Job.job_id == job_id).scalar()
+        db.commit()
+
+        outdir = RESULTS_DIR / f"job_{job_id}" / f"iter_{iteration}_{run_stage}"
+        outdir.mkdir(parents=True, exist_ok=True)
+
+        log_file = outdir / "pipeline.log"
+
+        # Iterations share the job's launch dir (.nextflow session history) and work
+        # dir, so with -resume only tasks whose inputs or parameters changed re-run.
+        # Previews have a session of their own, so they never wait for a full run.
+        launch_dir = RESULTS_DIR / f"job_{job_id}"
+        if run_stage == PREVIEW_STAGE:
+            launch_dir = launch_dir / PREVIEW_STAGE
+        work_dir = launch_dir / "work"
+        launch_dir.mkdir(parents=True, exist_ok=True)
+
+        # Run from content-addressed copies, so re-uploading a sample or reference
+        # under the same name cannot change the inputs of a queued run
+        run_ref = ref_path if run_stage != PREVIEW_STAGE else None
+        run_reads, run_ref = store.pin_inputs(db, job_id, iteration, reads_pattern, run_ref)
+
+        samplesheet_path = None
+        if samples:
+            run_samples = [dict(sample) for sample in samples]
+            for sample in run_samples:
+                sample["fastq_1"], sample["fastq_2"] = store.pin_files(
+                    db, job_id, iteration, [sample["fastq_1"], sample["fastq_2"]]
+                )
+            samplesheet_path = outdir / SAMPLESHEET_FILE
+            write_samplesheet(samplesheet_path, run_samples)
+
+        # Task cpus/memory and queue depth (see nextflow.config profiles); a
+        # preview's subsample always fits the smallest profile
+        if run_stage == PREVIEW_STAGE:
+            run_resources, resource_cmd = resource_args("small", None, None)
+        else:
+            reads_files = [s[key] for s in samples or [] for key in ("fastq_1", "fastq_2")]
+            run_resources, resource_cmd = resource_args(resources, run_reads, run_ref, reads_files)
+
+        cmd = [
+            "nextflow", "run", PIPELINE,
+            "-profile", f"{PUBLISH_POLICIES[publish_policy]},{run_resources}",
+            "-work-dir", str(work_dir),
+            "--stage", run_stage,
+            "--qual", str(qual),
+            "--min_len", str(min_len),
+            "--qc_engine", qc_engine,
+            "--skip_trimmed_qc", str(skip_trimmed_qc).lower(),
+            "--summary_mode", summary_mode,
+            "--preview_reads", str(preview_reads or PREVIEW_READS),
+            "--outdir", str(outdir),
+            "--index_cache", INDEX_CACHE_DIR,
+            "--minimap2_preset", preset,
+            "--shard_size", str(shard_size),
+            "--fused_align", str(fused_align).lower(),
+            "--markdup", str(markdup).lower(),
+            *resource_cmd
+        ]
+
+        if resume:
+            cmd.append("-resume")
+
+        if samplesheet_path:
+            cmd.extend(["--samplesheet", str(samplesheet_path)])
+        elif run_reads:
+            cmd.extend(["--reads", run_reads])
+
+        if run_ref:
+            cmd.extend(["--ref", run_ref])
+            if ref_sha256:
+                cmd.extend(["--ref_sha256", ref_sha256])
+
+        # Queue the run; the scheduler starts it once a slot is free
+        log_file.touch()
+        run = Run(
+            job_id=job_id,
+            iteration=iteration,
+            log=str(log_file),
+            offset=0,
+            stage=run_stage,
+            outdir=str(outdir),
+            state="queued",
+            priority=priority,
+            command=json.dumps(cmd),
+            launch_dir=str(launch_dir)
+        )
+        db.add(run)
+        db.commit()
+        return run, run_resources
+
+    preview = None
+    if preview_reads and stage != PREVIEW_STAGE:
+        preview, _ = queue(PREVIEW_STAGE)
+    run, resources = queue(stage)
+    scheduler.wake()
 
+    return {
+        "job_id": job_id,
+        "iteration": run.iteration,
+        "stage": stage,
+        "resources": resources,
+        "samples": [sample["sample"] for sample in samples] if samples else None,
+        "state": run.state,
+        "queue_position": queue_position(db, run),
+        "preview": {
+            "iteration": preview.iteration,
+            "reads": preview_reads,
+            "samples": f"/jobs/{job_id}/samples/{preview.iteration}",
+        } if preview else None
+    }
 
-    proc = subprocess.Popen(
-        cmd,
-        cwd=BASE_DIR,
-        stdout=open(log_file, "w"),
-        stderr=subprocess.STDOUT
-    )
+# -------------------------------------------------
+# QUEUE STATUS & CANCELLATION
+# -------------------------------------------------
+@app.get("/jobs/{job_id}/queue/{iteration}")
+def get_queue_status(job_id: str, iteration: int, db: Session = Depends(get_db)):
+    run = get_run(db, job_id, iteration)
+    return {
+        "job_id": job_id,
+        "iteration": iteration,
+        "state": run.state,
+        "queue_position": queue_position(db, run),
+        "running": db.query(Run).filter(Run.state == RUNNING).count(),
+        "max_concurrent": scheduler.max_concurrent
+    }
 
-    JOBS[job_id]["runs"][iteration] = {
-        "pid": proc.pid,
-        "log": str(log_file),
-        "offset": 0,
-        "stage": stage,
-        "outdir": outdir
+
+@app.get("/jobs/{job_id}/status/{iteration}")
+def get_run_status(job_id: str, iteration: int, db: Session = Depends(get_db)):
+    """Run state and exit code from the scheduler, plus per-process status
+    parsed from the run's Nextflow trace.txt"""
+    run = get_run(db, job_id, iteration)
+    return run_status(run, queue_position(db, run), run_reuse(db, run))
+
+
+@app.get("/jobs/{job_id}/samples/{iteration}")
+def get_sample_progress(job_id: str, iteration: int, db: Session = Depends(get_db)):
+    """Per-sample task progress and QC verdict of a run (all samples of a
+    sample sheet, or those seen so far in the trace)"""
+    run = get_run(db, job_id, iteration)
+    samples = [row["sample"] for row in read_samplesheet(Path(run.outdir) / SAMPLESHEET_FILE)]
+    progress = sample_progress(run, samples)
+    for sample, entry in progress.items():
+        entry["reports"] = f"/qc/{job_id}/{iteration}/{sample}"
+    return {
+        "job_id": job_id,
+        "iteration": iteration,
+        "state": run.state,
+        "samples": progress,
     }
 
-    return {"job_id": job_id, "iteration": iteration, "stage": stage}
+
+@app.post("/jobs/{job_id}/cancel/{iteration}")
+def cancel_run(job_id: str, iteration: int, db: Session = Depends(get_db)):
+    run = get_run(db, job_id, iteration)
+    if not scheduler.cancel(db, run):
+        raise HTTPException(409, f"Run already {run.state}")
+    return {"job_id": job_id, "iteration": iteration, "state": run.state}
 
 # -------------------------------------------------
 # STREAM LOGS
 # -------------------------------------------------
+LOG_POLL_INTERVAL = 0.5       # seconds between checks for new log lines
+LOG_HEARTBEAT_INTERVAL = 15   # seconds between SSE keep-alive comments
+LOG_CHUNK_SIZE = 1024 * 1024
+
+
 @app.get("/jobs/{job_id}/logs/{iteration}")
-def get_logs(job_id: str, iteration: int):
-    run = JOBS.get(job_id, {}).get("runs", {}).get(iteration)
+def get_logs(job_id: str, iteration: int, offset: Optional[int] = None, db: Session = Depends(get_db)):
+    """Poll for new log output. Pass `offset` (the value returned by the
+    previous call) to keep a private cursor; without it the run's shared
+    cursor is used."""
+    run = db.get(Run, (job_id, iteration))
     if not run:
         raise HTTPException(404, "Invalid job or iteration")
 
-    with open(run["log"]) as f:
-        f.seek(run["offset"])
-        data = f.read()
-        run["offset"] = f.tell()
+    with open(run.log, "rb") as f:
+        f.seek(run.offset if offset is None else offset)
+        data = f.read().decode("utf-8", errors="replace")
+        new_offset = f.tell()
+
+    if offset is None:
+        run.offset = new_offset
+        db.commit()
+
+    # The scheduler's reaped exit status decides completion, not log markers
+    return {
+        "logs": data,
+        "done": run.state in FINISHED_STATES,
+        "state": run.state,
+        "exit_code": run.exit_code,
+        "offset": new_offset
+    }
 
-    done = "Succeeded" in data or "Completed at:" in data
-    return {"logs": data, "done": done}
+
+def read_log_lines(path: str, offset: int, complete_only: bool = True) -> bytes:
+    """Bytes of `path` from `offset`, cut after the last newline unless
+    `complete_only` is False (or a single line exceeds LOG_CHUNK_SIZE)"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read(LOG_CHUNK_SIZE)
+    except FileNotFoundError:
+        return b""
+    if complete_only and len(chunk) < LOG_CHUNK_SIZE:
+        return chunk[:chunk.rfind(b"\n") + 1]
+    return chunk
+
+
+def run_state(job_id: str, iteration: int) -> Optional[str]:
+    db = SessionLocal()
+    try:
+        run = db.get(Run, (job_id, iteration))
+        return run.state if run else None
+    finally:
+        db.close()
+
+
+@app.get("/jobs/{job_id}/logs/{iteration}/stream")
+async def stream_logs(job_id: str, iteration: int, request: Request, offset: int = 0,
+                      db: Session = Depends(get_db)):
+    """Server-Sent Events tail of pipeline.log. Each client keeps its own
+    cursor: events carry the byte offset as their id, so a reconnecting
+    EventSource resumes via Last-Event-ID. A final `done` event carries the
+    run state."""
+    run = db.get(Run, (job_id, iteration))
+    if not run:
+        raise HTTPException(404, "Invalid job or iteration")
+    log_path = run.log
+
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        offset = int(last_event_id)
+
+    def event(chunk: bytes, cursor: int) -> str:
+        lines = chunk.decode("utf-8", errors="replace").rstrip("\n").split("\n")
+        data = "".join(f"data: {line.rstrip(chr(13))}\n" for line in lines)
+        return f"id: {cursor}\n{data}\n"
+
+    async def events():
+        # File reads and the run-state query (which can wait on the scheduler's
+        # write lock) run in the threadpool, never on the event loop
+        cursor = offset
+        idle = 0.0
+        while not await request.is_disconnected():
+            chunk = await run_in_threadpool(read_log_lines, log_path, cursor)
+            if chunk:
+                cursor += len(chunk)
+                idle = 0.0
+                yield event(chunk, cursor)
+                continue
+
+            state = await run_in_threadpool(run_state, job_id, iteration)
+            if state is None or state in FINISHED_STATES:
+                # Flush a trailing line without newline, then close the stream
+                rest = await run_in_threadpool(read_log_lines, log_path, cursor, False)
+                while rest:
+                    cursor += len(rest)
+                    yield event(rest, cursor)
+                    rest = await run_in_threadpool(read_log_lines, log_path, cursor, False)
+                yield f"event: done\ndata: {json.dumps({'state': state})}\n\n"
+                return
+
+            if idle >= LOG_HEARTBEAT_INTERVAL:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(LOG_POLL_INTERVAL)
+            idle += LOG_POLL_INTERVAL
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 # -------------------------------------------------
 # QC REPORT SERVING
 # -------------------------------------------------
-@app.get("/qc/{job_id}/{iteration}/{sample}")
-def list_qc_reports(job_id: str, iteration: int, sample: str):
-    if job_id not in JOBS:
-        raise HTTPException(status_code=404, detail="Invalid job_id")
+def sample_reads(run: Run) -> dict:
+    """sample -> input FASTQs of a sample sheet run (empty for --reads runs)"""
+    return {
+        row["sample"]: [row["fastq_1"], row["fastq_2"]]
+        for row in read_samplesheet(Path(run.outdir) / SAMPLESHEET_FILE)
+    }
 
-    runs = JOBS[job_id]["runs"]
-    if iteration not in runs:
-        raise HTTPException(status_code=404, detail="Invalid iteration")
 
-    outdir = runs[iteration]["outdir"]
-    reports = {}
+def report_manifest(db: Session, run: Run) -> dict:
+    """Reports of every sample of a finished run, built once (and written to
+    its outdir) and then served from memory until the run changes state"""
+    manifest = manifests.get(run) or read_manifest(run)
+    if manifest is None:
+        reads = sample_reads(run)
+        manifest = build_manifest(
+            run, run_samples(run, reads), run_reuse(db, run), run_outdirs(db, run.job_id), reads
+        )
+        write_manifest(run, manifest)
+    manifests.put(manifest)
+    return manifest
 
-    # -------- fastp --------
-    fastp = outdir / "trimmed_reads" / f"{sample}.fastp.html"
-    if fastp.exists():
-        reports["fastp"] = f"/qc/{job_id}/{iteration}/{fastp.relative_to(outdir)}"
 
-    # -------- falco raw --------
-    falco_raw = (
-        outdir
-        / "falco_raw"
-        / f"{sample}_falco_report"
-    )
-    if falco_raw.exists():
-        htmls = sorted(list(falco_raw.glob("*_fastqc_report.html")))
-        for html in htmls:
-            label = "falco_raw"
-            if "_1" in html.name or "_R1" in html.name:
-                label += "_R1"
-            elif "_2" in html.name or "_R2" in html.name:
-                label += "_R2"
-            if label in reports:
-                label += f"_{html.name}"
-            
-            reports[label] = f"/qc/{job_id}/{iteration}/{html.relative_to(outdir)}"
-
-    # -------- falco trimmed --------
-    falco_trimmed = (
-        outdir
-        / "falco_trimmed"
-        / f"{sample}_falco_trimmed"
-    )
-    if falco_trimmed.exists():
-        htmls = sorted(list(falco_trimmed.glob("*_fastqc_report.html")))
-        for html in htmls:
-            label = "falco_trimmed"
-            if "_1" in html.name or "_R1" in html.name:
-                label += "_R1"
-            elif "_2" in html.name or "_R2" in html.name:
-                label += "_R2"
-            
-            if label in reports:
-                label += f"_{html.name}"
-
-            reports[label] = f"/qc/{job_id}/{iteration}/{html.relative_to(outdir)}"
-
-    # -------- qc summary (new) --------
-    qc_summary_dir = outdir / "qc_summary"
-    if qc_summary_dir.exists():
-        # JSON Reports
-        jsons = sorted(list(qc_summary_dir.glob("*_report.json")))
-        for j in jsons:
-            # e.g. ecoli_R1.trimmed.fastq.gz_Trimmed_report.json
-            # Clean up label
-            name = j.name.replace("_report.json", "")
-            label = f"Summary JSON ({name})"
-            reports[label] = f"/qc/{job_id}/{iteration}/{j.relative_to(outdir)}"
-
-    if not reports:
+def publish_report_manifest(job_id: str, iteration: int) -> None:
+    """Scheduler hook: index a run's reports as soon as it finishes"""
+    db = SessionLocal()
+    try:
+        manifests.invalidate(job_id, iteration)
+        report_manifest(db, get_run(db, job_id, iteration))
+    finally:
+        db.close()
+
+
+scheduler.on_finish = publish_report_manifest
+
+
+@app.get("/qc/{job_id}/{iteration}/{sample}")
+def list_qc_reports(job_id: str, iteration: int, sample: str, db: Session = Depends(get_db)):
+    run = get_run(db, job_id, iteration)
+
+    # Outputs of queued or running runs still change: scan for this sample.
+    # Reports of tasks resumed from an earlier iteration link to that iteration.
+    if run.state in FINISHED_STATES:
+        entry = report_manifest(db, run)["samples"].get(sample)
+    else:
+        entry = sample_reports(
+            run, sample, run_reuse(db, run), run_outdirs(db, job_id), sample_reads(run).get(sample, ())
+        )
+
+    if not entry or not entry["reports"]:
         raise HTTPException(status_code=404, detail="No QC reports found for sample")
 
     return {
         "job_id": job_id,
         "iteration": iteration,
         "sample": sample,
-        "reports": reports
+        "reports": entry["reports"],
+        "reused": entry["reused"],
+        "estimated": entry["estimated"]
     }
 
 
 @app.get("/qc/{job_id}/{iteration}/{path:path}")
-def serve_qc_file(job_id: str, iteration: int, path: str):
-
-    if job_id not in JOBS:
-        raise HTTPException(404, "Invalid job_id")
-
-    runs = JOBS[job_id]["runs"]
-    if iteration not in runs:
-        raise HTTPException(404, "Invalid iteration")
+def serve_qc_file(job_id: str, iteration: int, path: str, db: Session = Depends(get_db)):
 
-    outdir: Path = runs[iteration]["outdir"]
+    outdir = Path(get_run(db, job_id, iteration).outdir)
 
     requested = Path(path)
     if ".." in requested.parts:
@@ -403,6 +1058,8 @@ def serve_qc_file(job_id: str, iteration: int, path: str):
     media_type = "text/html"
     if file_path.suffix == ".json":
         media_type = "application/json"
+    elif file_path.suffix == ".jsonl":
+        media_type = "application/x-ndjson"
     elif file_path.suffix == ".txt":
         media_type = "text/plain"
 
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, String, DateTime
+from sqlalchemy import create_engine, event, Column, String, DateTime, Integer, Boolean, Text, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -9,7 +9,17 @@ from pathlib import Path
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, 'users.db')}"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False, "timeout": 30})
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets several API workers read the job registry while one writes"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -30,6 +40,103 @@ class User(Base):
         return f"<User(email={self.email}, username={self.username})>"
 
 
+# -------------------------------------------------
+# JOB REGISTRY MODELS
+# -------------------------------------------------
+class Job(Base):
+    __tablename__ = "jobs"
+
+    job_id = Column(String, primary_key=True, index=True)
+    iterations = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Job(job_id={self.job_id}, iterations={self.iterations})>"
+
+
+class Run(Base):
+    __tablename__ = "runs"
+    __table_args__ = (
+        Index("ix_runs_job_id_iteration", "job_id", "iteration", unique=True),
+    )
+
+    job_id = Column(String, ForeignKey("jobs.job_id"), primary_key=True)
+    iteration = Column(Integer, primary_key=True)
+    stage = Column(String, nullable=False)
+    pid = Column(Integer, nullable=True)
+    log = Column(String, nullable=False)
+    offset = Column(Integer, nullable=False, default=0)
+    outdir = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Scheduling (see scheduler.py): queued -> running -> done / failed / cancelled
+    state = Column(String, nullable=False, default="queued", index=True)
+    priority = Column(Integer, nullable=False, default=0)
+    command = Column(Text, nullable=False)  # JSON list passed to Popen
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    exit_code = Column(Integer, nullable=True)  # nextflow's exit status once reaped
+    # Nextflow launch dir, shared by a job's iterations so -resume finds its session
+    launch_dir = Column(String, nullable=True)
+
+    def __repr__(self):
+        return f"<Run(job_id={self.job_id}, iteration={self.iteration}, stage={self.stage}, state={self.state})>"
+
+
+# -------------------------------------------------
+# RESUMABLE UPLOAD MANIFEST
+# -------------------------------------------------
+class Upload(Base):
+    __tablename__ = "uploads"
+
+    upload_id = Column(String, primary_key=True, index=True)
+    dest = Column(String, nullable=False)       # final path once complete
+    tmp_path = Column(String, nullable=False)   # preallocated file parts are written into
+    size = Column(Integer, nullable=False)
+    part_size = Column(Integer, nullable=False)
+    sha256 = Column(String, nullable=True)      # expected checksum, if the client sent one
+    gzip_check = Column(Boolean, nullable=False, default=True)
+    state = Column(String, nullable=False, default="uploading")  # uploading -> completing -> complete
+    created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Upload(upload_id={self.upload_id}, dest={self.dest}, state={self.state})>"
+
+
+class UploadPart(Base):
+    __tablename__ = "upload_parts"
+
+    upload_id = Column(String, ForeignKey("uploads.upload_id"), primary_key=True)
+    part_number = Column(Integer, primary_key=True)
+    size = Column(Integer, nullable=False)
+    sha256 = Column(String, nullable=False)
+    received_at = Column(DateTime, default=datetime.utcnow)
+
+
+# -------------------------------------------------
+# CONTENT-ADDRESSED INPUT STORE (see store.py)
+# -------------------------------------------------
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    sha256 = Column(String, primary_key=True, index=True)
+    path = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BlobRef(Base):
+    __tablename__ = "blob_refs"
+
+    # A readable name (data_test/..., ref_test/...) or a run pin ("run:<job_id>:<iteration>:<file>")
+    ref = Column(String, primary_key=True)
+    sha256 = Column(String, ForeignKey("blobs.sha256"), nullable=False, index=True)
+    job_id = Column(String, nullable=True)
+    iteration = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 # -------------------------------------------------
 # DATABASE INITIALIZATION
 # -------------------------------------------------
@@ -0,0 +1,550 @@
+import os
+import json
+import math
+import queue
+import zlib
+import shutil
+import argparse
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from summary import (
+    QC_RULES, VectorizedQCEvaluator, cohort_row, estimated_results, write_cohort, resolve_workers
+)
+
+# ======================================================
+# 1. SETTINGS
+# ======================================================
+
+# Compressed bytes read per call, and decompressed bytes handed to a parser
+READ_SIZE = 4 * 1024 * 1024
+BLOCK_SIZE = 8 * 1024 * 1024
+# Parsed blocks waiting per file; bounds memory when parsing falls behind
+QUEUE_BLOCKS = 4
+
+# External gzip decoders, first one installed wins. They inflate in a process
+# of their own (pigz on several threads), so decompression no longer shares a
+# core with the reader thread. FASTQ_QC_DECOMPRESSOR overrides the choice
+# with a command, or "zlib" to inflate in-process.
+DECOMPRESSORS = (("pigz", "-dc"), ("igzip", "-dc"))
+
+PHRED_OFFSET = 33
+MAX_QUALITY = 64
+
+# Duplication, overrepresented sequences and k-mers are estimated from the
+# first reads of each file (FastQC also samples for these modules)
+SAMPLE_READS = 200_000
+# FastQC truncates reads longer than 75 bp to 50 bp for duplication
+DUP_TRUNCATE_ABOVE = 75
+DUP_TRUNCATE_TO = 50
+
+KMER_SIZE = 7
+KMER_POS_BIN = 5      # Positions are grouped in bins of this width
+KMER_POS_BINS = 64    # Positions past the last bin are counted in it
+KMER_MIN_COUNT = 10   # Observations needed in the enriched bin
+KMER_MIN_Z = 3.0      # Poisson z-score of that bin over its expectation
+
+# A C G T N -> 0..4, anything else counts as N
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+    BASE_CODES[_base] = _code
+    BASE_CODES[_base + 32] = _code  # lower case
+
+
+# ======================================================
+# 2. ACCUMULATORS
+# ======================================================
+
+def _grow(counts, length):
+    # Pad a per-position table with zero rows up to `length` positions
+    if counts.shape[0] >= length:
+        return counts
+    pad = np.zeros((length - counts.shape[0],) + counts.shape[1:], dtype=counts.dtype)
+    return np.concatenate([counts, pad])
+
+
+class FastqAccumulator:
+    """Running counts for one FASTQ file, updated a block of records at a
+    time with NumPy. Each parser thread owns one; merge() combines them."""
+
+    def __init__(self):
+        self.reads = 0
+        self.quality = np.zeros((0, MAX_QUALITY), dtype=np.int64)  # position x phred
+        self.bases = np.zeros((0, 5), dtype=np.int64)              # position x ACGTN
+        self.mean_quality = np.zeros(MAX_QUALITY, dtype=np.int64)
+        self.gc = np.zeros(101, dtype=np.int64)                     # reads by GC %
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.sequences = Counter()
+        self.sampled_reads = 0
+        self.kmers = np.zeros(4 ** KMER_SIZE * KMER_POS_BINS, dtype=np.int64)
+
+    def add_block(self, block, sample=False):
+        buf = np.frombuffer(block, dtype=np.uint8)
+        ends = np.flatnonzero(buf == 10)
+        n_lines = len(ends) - len(ends) % 4
+        if not n_lines:
+            return
+        ends = ends[:n_lines]
+        starts = np.concatenate(([0], ends[:-1] + 1))
+
+        seq_starts = starts[1::4]
+        seq_ends = ends[1::4]
+        # Windows line endings
+        seq_ends = seq_ends - (buf[np.maximum(seq_ends - 1, 0)] == 13) * (seq_ends > seq_starts)
+        qual_starts = starts[3::4]
+        lengths = seq_ends - seq_starts
+        n = len(lengths)
+        total = int(lengths.sum())
+
+        read_index = np.repeat(np.arange(n), lengths)
+        read_offset = np.cumsum(lengths) - lengths
+        pos = np.arange(total) - np.repeat(read_offset, lengths)
+        codes = BASE_CODES[buf[seq_starts[read_index] + pos]]
+        quals = np.clip(buf[qual_starts[read_index] + pos].astype(np.int64) - PHRED_OFFSET, 0, MAX_QUALITY - 1)
+
+        max_len = int(lengths.max()) if n else 0
+        self.reads += n
+        self.quality = _grow(self.quality, max_len)
+        self.bases = _grow(self.bases, max_len)
+        self.lengths = _grow(self.lengths, max_len + 1)
+
+        self.quality[:max_len] += np.bincount(pos * MAX_QUALITY + quals, minlength=max_len * MAX_QUALITY) \
+            .reshape(max_len, MAX_QUALITY)
+        self.bases[:max_len] += np.bincount(pos * 5 + codes, minlength=max_len * 5).reshape(max_len, 5)
+        self.lengths[:max_len + 1] += np.bincount(lengths, minlength=max_len + 1)
+
+        safe = np.maximum(lengths, 1)
+        read_quality = np.bincount(read_index, weights=quals, minlength=n) / safe
+        self.mean_quality += np.bincount(read_quality.astype(np.int64), minlength=MAX_QUALITY)[:MAX_QUALITY]
+
+        gc_bases = np.bincount(read_index, weights=(codes == 1) | (codes == 2), minlength=n)
+        acgt_bases = np.bincount(read_index, weights=codes < 4, minlength=n)
+        read_gc = np.rint(100 * gc_bases / np.maximum(acgt_bases, 1)).astype(np.int64)
+        self.gc += np.bincount(read_gc[acgt_bases > 0], minlength=101)
+
+        if sample:
+            self._add_sample(block, seq_starts, seq_ends, codes, pos, lengths, read_index)
+
+    def _add_sample(self, block, seq_starts, seq_ends, codes, pos, lengths, read_index):
+        self.sampled_reads += len(lengths)
+        self.sequences.update(
+            block[start:end] if end - start <= DUP_TRUNCATE_ABOVE else block[start:start + DUP_TRUNCATE_TO]
+            for start, end in zip(seq_starts.tolist(), seq_ends.tolist())
+        )
+
+        # 2-bit k-mer codes, built by shifting the flat base codes; a k-mer is
+        # kept if it lies inside one read and contains no N
+        total = len(codes)
+        if total < KMER_SIZE:
+            return
+        span = total - KMER_SIZE + 1
+        kmer = np.zeros(span, dtype=np.int64)
+        has_n = np.zeros(span, dtype=bool)
+        for offset in range(KMER_SIZE):
+            window = codes[offset:offset + span]
+            kmer = (kmer << 2) | (window & 3)
+            has_n |= window == 4
+        fits = pos[:span] + KMER_SIZE <= lengths[read_index[:span]]
+        keep = fits & ~has_n
+        bins = np.minimum(pos[:span][keep] // KMER_POS_BIN, KMER_POS_BINS - 1)
+        self.kmers += np.bincount(kmer[keep] * KMER_POS_BINS + bins, minlength=len(self.kmers))
+
+    def merge(self, other):
+        self.reads += other.reads
+        length = max(self.quality.shape[0], other.quality.shape[0])
+        self.quality = _grow(self.quality, length) + _grow(other.quality, length)
+        self.bases = _grow(self.bases, length) + _grow(other.bases, length)
+        self.lengths = _grow(self.lengths, length + 1) + _grow(other.lengths, length + 1)
+        self.mean_quality += other.mean_quality
+        self.gc += other.gc
+        self.sequences.update(other.sequences)
+        self.sampled_reads += other.sampled_reads
+        self.kmers += other.kmers
+        return self
+
+
+# ======================================================
+# 3. STREAMING READER
+# ======================================================
+
+def _decompressor():
+    # Command of the external gzip decoder to use, or None for zlib
+    choice = os.environ.get("FASTQ_QC_DECOMPRESSOR")
+    if choice:
+        return None if choice == "zlib" else choice.split()
+    for command in DECOMPRESSORS:
+        if shutil.which(command[0]):
+            return list(command)
+    return None
+
+
+def _piped_chunks(command):
+    """Yield the stdout of `command` (an external decoder); a failed or
+    truncated input raises EOFError like the in-process path"""
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        yield from iter(lambda: proc.stdout.read(READ_SIZE), b"")
+        error = proc.stderr.read().decode("utf-8", "replace").strip()
+        if proc.wait() != 0:
+            raise EOFError(f"{command[0]} failed: {error or 'exit status ' + str(proc.returncode)}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def _decompressed_chunks(path):
+    """Yield decompressed data of a FASTQ file; gzip (multi-member) or plain.
+    gzip is inflated by an external decoder when one is installed (see
+    DECOMPRESSORS); without one, zlib inflates on the calling thread, which
+    then caps the throughput of a file at one core's inflate speed."""
+    with open(path, "rb") as f:
+        head = f.read(2)
+        f.seek(0)
+        if head != b"\x1f\x8b":
+            yield from iter(lambda: f.read(READ_SIZE), b"")
+            return
+
+        command = _decompressor()
+        if command:
+            yield from _piped_chunks(command + [path])
+            return
+
+        inflater = zlib.decompressobj(wbits=31)
+        in_member = False
+        for raw in iter(lambda: f.read(READ_SIZE), b""):
+            while True:
+                in_member = True
+                # At most BLOCK_SIZE at a time, so a highly compressed block
+                # cannot inflate into memory in one piece
+                data = inflater.decompress(raw, BLOCK_SIZE)
+                if data:
+                    yield data
+                if inflater.eof:
+                    in_member = False
+                    raw = inflater.unused_data
+                    inflater = zlib.decompressobj(wbits=31)
+                    if not raw:
+                        break
+                else:
+                    raw = inflater.unconsumed_tail
+                    # A full output block may leave more pending in zlib
+                    if not raw and len(data) < BLOCK_SIZE:
+                        break
+        # Like uploads.GzipValidator: a member cut short must not pass as a
+        # shorter file
+        if in_member:
+            raise EOFError("truncated gzip member")
+
+
+def record_blocks(path):
+    """Yield (block, first_read) with `block` holding whole 4-line records,
+    cut from the decompressed stream at record boundaries"""
+    pending = bytearray()
+    reads = 0
+    for data in _decompressed_chunks(path):
+        pending += data
+        if len(pending) < BLOCK_SIZE:
+            continue
+        cut = _record_boundary(pending)
+        if cut:
+            block = bytes(pending[:cut])
+            del pending[:cut]
+            yield block, reads
+            reads += block.count(b"\n") // 4
+
+    if pending:
+        if not pending.endswith(b"\n"):
+            pending += b"\n"
+        yield bytes(pending), reads
+
+
+def _record_boundary(data):
+    # Offset just past the last complete record (every 4th newline)
+    ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10)
+    n = len(ends) - len(ends) % 4
+    return int(ends[n - 1]) + 1 if n else 0
+
+
+def _records_offset(block, records):
+    # Offset just past the first `records` records of a block
+    ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+    return int(ends[4 * records - 1]) + 1
+
+
+def sampled_blocks(path):
+    """record_blocks as (block, sample) pairs, with the block that crosses
+    SAMPLE_READS split there, so exactly the first SAMPLE_READS reads are
+    sampled whatever the block size"""
+    for block, first_read in record_blocks(path):
+        if first_read >= SAMPLE_READS:
+            yield block, False
+            continue
+        wanted = SAMPLE_READS - first_read
+        if block.count(b"\n") // 4 <= wanted:
+            yield block, True
+            continue
+        cut = _records_offset(block, wanted)
+        yield block[:cut], True
+        yield block[cut:], False
+
+
+def profile_fastq(path, threads=2):
+    """Stream one FASTQ file once and return its FastqAccumulator.
+
+    A reader thread cuts the decompressed stream into record blocks;
+    `threads` parser threads (the NumPy kernels release the GIL) each fold
+    blocks into their own accumulator, merged at the end. Inflating gzip is
+    left to an external decoder when one is installed (see
+    _decompressed_chunks); otherwise it runs on the reader thread, and past
+    a couple of parser threads that single inflate stream is the limit."""
+    parsers = max(1, threads)
+    blocks = queue.Queue(maxsize=QUEUE_BLOCKS * parsers)
+    errors = []
+
+    def read():
+        try:
+            for block, sample in sampled_blocks(path):
+                blocks.put((block, sample))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(parsers):
+                blocks.put(None)
+
+    def parse():
+        acc = FastqAccumulator()
+        while True:
+            item = blocks.get()
+            if item is None:
+                return acc
+            if not errors:
+                try:
+                    acc.add_block(*item)
+                except Exception as e:
+                    errors.append(e)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    with ThreadPoolExecutor(max_workers=parsers) as pool:
+        accumulators = list(pool.map(lambda _: parse(), range(parsers)))
+    reader.join()
+    if errors:
+        raise errors[0]
+
+    result = accumulators[0]
+    for acc in accumulators[1:]:
+        result.merge(acc)
+    return result
+
+
+# ======================================================
+# 4. METRICS
+# ======================================================
+
+def _percentile(counts, fraction):
+    # Per row, the first quality whose cumulative count reaches `fraction`
+    cumulative = np.cumsum(counts, axis=1)
+    return (cumulative >= cumulative[:, -1:] * fraction).argmax(axis=1).astype("d")
+
+
+def _gc_deviation(gc):
+    # Sum of deviations from a normal fitted to the GC distribution, as a
+    # percentage of reads (FastQC's Per sequence GC content statistic)
+    total = gc.sum()
+    if not total:
+        return 0.0
+    percent = np.arange(101)
+    mean = (gc * percent).sum() / total
+    sd = math.sqrt(max((gc * (percent - mean) ** 2).sum() / total, 1e-12))
+    expected = np.exp(-0.5 * ((percent - mean) / sd) ** 2)
+    expected = expected / expected.sum() * total
+    return float(np.abs(gc - expected).sum() / total * 100)
+
+
+def _kmer_enrichment(kmers):
+    # Max Obs/Exp over position bins of k-mers whose enriched bin is both
+    # frequent and significant; the expectation spreads a k-mer's total over
+    # the bins in proportion to each bin's k-mer count
+    counts = kmers.reshape(4 ** KMER_SIZE, KMER_POS_BINS).astype("d")
+    bin_share = counts.sum(axis=0) / max(counts.sum(), 1)
+    expected = counts.sum(axis=1, keepdims=True) * bin_share
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(expected > 0, counts / expected, 0.0)
+        z = np.where(expected > 0, (counts - expected) / np.sqrt(expected), 0.0)
+    significant = (counts >= KMER_MIN_COUNT) & (z >= KMER_MIN_Z)
+    best = np.where(significant, ratio, 0.0).max(axis=1)
+    return best[best > 1.0]
+
+
+def accumulator_metrics(acc, name, rules=QC_RULES):
+    """Column-form metrics (as FastQCParser.metric_columns returns them) and
+    summary metrics for one profiled file."""
+    length = acc.quality.shape[0]
+    base_labels = [str(i + 1) for i in range(length)]
+
+    acgt = acc.bases[:, :4].sum(axis=1)
+    all_bases = acc.bases.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        content = {b: np.nan_to_num(acc.bases[:, i] * 100.0 / acgt) for i, b in enumerate("ACGT")}
+        n_content = np.nan_to_num(acc.bases[:, 4] * 100.0 / all_bases)
+
+    observed = np.flatnonzero(acc.lengths)
+    min_len = int(observed[0]) if len(observed) else 0
+    max_len = int(observed[-1]) if len(observed) else 0
+    total_acgt = acc.bases[:, :4].sum()
+    gc_percent = int(acc.bases[:, 1:3].sum() * 100 // total_acgt) if total_acgt else 0
+
+    counted = sum(acc.sequences.values())
+    duplication_rate = 100.0 - len(acc.sequences) * 100.0 / counted if counted else 0.0
+    overrepresented = [
+        (seq, count * 100.0 / counted) for seq, count in acc.sequences.most_common()
+        if counted and count * 100.0 / counted > 0.1
+    ]
+
+    gc_thresholds = rules.get("per_sequence_gc_content", QC_RULES["per_sequence_gc_content"])["thresholds"]
+    deviation = _gc_deviation(acc.gc)
+    gc_status = (
+        "fail" if deviation > gc_thresholds["fail"]["deviation_sum"]
+        else "warn" if deviation > gc_thresholds["warn"]["deviation_sum"]
+        else "pass"
+    )
+
+    stats = {
+        "Filename": name,
+        "File type": "Conventional base calls",
+        "Encoding": "Sanger / Illumina 1.9",
+        "Total Sequences": str(acc.reads),
+        "Sequences flagged as poor quality": "0",
+        "Sequence length": str(max_len) if min_len == max_len else f"{min_len}-{max_len}",
+        "%GC": str(gc_percent),
+    }
+
+    quality_scores = np.flatnonzero(acc.mean_quality)
+    metrics = {
+        "basic_statistics": stats,
+        "per_base_sequence_quality": {
+            "base": base_labels,
+            "median": _percentile(acc.quality, 0.5),
+            "lower_quartile": _percentile(acc.quality, 0.25),
+        },
+        "per_sequence_quality_scores": {
+            "quality": quality_scores.astype("l"),
+            "count": acc.mean_quality[quality_scores].astype("d"),
+        },
+        "per_base_sequence_content": {"base": base_labels, "G": content["G"], "A": content["A"],
+                                      "T": content["T"], "C": content["C"]},
+        "per_base_gc_content": {"base": base_labels, "gc": content["G"] + content["C"], "mean_gc": float(gc_percent)},
+        "per_sequence_gc_content": {"status": gc_status},
+        "per_base_n_content": {"base": base_labels, "n_content": n_content},
+        "sequence_length_distribution": {
+            "length": [str(l) for l in observed],
+            "count": acc.lengths[observed].astype("d"),
+        },
+        "duplicate_sequences": {"duplication_rate": duplication_rate},
+        "overrepresented_sequences": {
+            "sequence": [seq.decode("ascii", "replace") for seq, _ in overrepresented],
+            "percentage": np.array([pct for _, pct in overrepresented], dtype="d"),
+        },
+        "overrepresented_kmers": {"enrichment": _kmer_enrichment(acc.kmers)},
+    }
+    if not acc.reads:
+        # Nothing to grade: like summary.py on a report without reads, every
+        # module but the basic statistics comes out UNKNOWN
+        metrics = {"basic_statistics": stats}
+    summary = {
+        "total_sequences": acc.reads,
+        "sequence_length": stats["Sequence length"],
+        "gc_percent": gc_percent,
+        "duplication_rate": duplication_rate,
+    }
+    return metrics, summary
+
+
+def evaluate_fastq(path, threads=2, rules=QC_RULES):
+    """Profile a FASTQ file and evaluate it against `rules` in one pass, with
+    no report files in between. Returns {"results", "metrics"} like
+    summary.evaluate_report."""
+    acc = profile_fastq(path, threads)
+    metrics, summary = accumulator_metrics(acc, os.path.basename(path), rules)
+    results = VectorizedQCEvaluator({key: metrics.get(key) for key in rules}, rules).evaluate()
+    return {"results": results, "metrics": summary}
+
+
+# ======================================================
+# 5. MAIN
+# ======================================================
+
+def report_name(path, stage):
+    """Same naming as summary.find_reports, e.g. 'ecoli_1.fastq.gz (Raw)'"""
+    return f"{os.path.basename(path)} ({stage.capitalize()})"
+
+
+def run_native_qc(paths, stage="raw", threads=None, output_dir="qc_results", cohort_path=None,
+                  estimated=False):
+    """Evaluate FASTQ files (e.g. both mates) concurrently, writing
+    <output_dir>/<name>_report.json per file like summary.run_qc (and, like
+    it, marking the outcomes as estimated for a read subsample)."""
+    os.makedirs(output_dir, exist_ok=True)
+    threads = resolve_workers(threads)
+    per_file = max(1, threads // max(1, len(paths)))
+
+    with ThreadPoolExecutor(max_workers=max(1, len(paths))) as pool:
+        evaluations = list(pool.map(lambda path: evaluate_fastq(path, per_file), paths))
+
+    rows = []
+    for path, evaluation in zip(paths, evaluations):
+        name = report_name(path, stage)
+        print(f"Processing FASTQ: {os.path.basename(path)}")
+        rows.append(cohort_row(name, evaluation, estimated))
+        out_base = name.replace(" ", "_").replace("(", "").replace(")", "").replace("/", "_")
+        results = estimated_results(evaluation["results"]) if estimated else evaluation["results"]
+        with open(os.path.join(output_dir, out_base + "_report.json"), "w") as f:
+            json.dump(results, f, indent=4)
+
+    if cohort_path:
+        written = write_cohort(cohort_path, rows)
+        print(f"Wrote cohort summary for {len(rows)} reports: {written}")
+    return evaluations
+
+
+def merge_cohorts(paths, cohort_path):
+    """Combine newline-delimited cohort tables into one (sorted) table"""
+    rows = []
+    for path in paths:
+        with open(path) as f:
+            rows.extend(json.loads(line) for line in f if line.strip())
+    return write_cohort(cohort_path, rows)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Evaluate FASTQ files against QC_RULES directly, without falco reports.")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    profile = commands.add_parser("profile", help="QC one or more FASTQ files (e.g. both mates)")
+    profile.add_argument("fastq", nargs="+")
+    profile.add_argument("--stage", default="raw", help="Report stage label: raw or trimmed (default: raw)")
+    profile.add_argument("-t", "--threads", type=int, default=None,
+                         help="Parser threads in total (default: $QC_SUMMARY_WORKERS or 1; 0 = one per CPU)")
+    profile.add_argument("--outdir", default="qc_results", help="Directory for the per-file JSON reports")
+    profile.add_argument("--cohort", default=None, metavar="PATH",
+                         help="Also write every file to one table (.jsonl, .csv or .parquet)")
+    profile.add_argument("--estimated", action="store_true",
+                         help="Mark every outcome as estimated (a read subsample, e.g. a preview)")
+
+    merge = commands.add_parser("merge", help="Merge .jsonl cohort tables")
+    merge.add_argument("tables", nargs="+")
+    merge.add_argument("--cohort", required=True, metavar="PATH")
+
+    args = arg_parser.parse_args()
+    if args.command == "profile":
+        run_native_qc(args.fastq, args.stage, args.threads, args.outdir, args.cohort, args.estimated)
+    else:
+        print(f"Wrote cohort summary: {merge_cohorts(args.tables, args.cohort)}")
@@ -4,7 +4,7 @@ import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
 import { Card, CardContent, CardDescription, CardFooter, CardHeader, CardTitle } from '@/components/ui/card';
 import { Select } from '@/components/ui/select';
-import { uploadReads, uploadReference, createJob, runPipeline, getLogs, getQCReports } from './api';
+import { uploadReads, uploadReference, createJob, runPipeline, streamLogs, getQCReports } from './api';
 import { Loader2, CheckCircle, XCircle, FileText, Play, ExternalLink, BarChart2, Scissors, Activity, Terminal, ChevronDown, ChevronUp } from 'lucide-react';
 import { QCSummary } from './components/QCSummary';
 import { UserNav } from './components/UserNav';
@@ -23,6 +23,7 @@ function App() {
   const [status, setStatus] = useState<'idle' | 'uploading' | 'running' | 'completed' | 'error'>('idle');
   const [logs, setLogs] = useState<string>('');
   const [reports, setReports] = useState<any>(null);
+  const [estimated, setEstimated] = useState(false);
   const [error, setError] = useState<string | null>(null);
   
   const [selectedReport, setSelectedReport] = useState<string | null>(null);
@@ -52,26 +53,24 @@ function App() {
   }, [reports]);
 
   useEffect(() => {
-    let interval: any;
+    if (status !== 'running' || !jobId || iteration === 0) return;
 
-    if (status === 'running' && jobId && iteration > 0) {
-      interval = setInterval(async () => {
-        try {
-          const data = await getLogs(jobId, iteration);
-          if (data.logs) {
-            setLogs((prev) => prev + data.logs);
-          }
-          if (data.done) {
-            setStatus('completed');
-            fetchReports();
-          }
-        } catch (err) {
-          console.error("Error fetching logs", err);
+    const close = streamLogs(
+      jobId,
+      iteration,
+      (chunk) => setLogs((prev) => prev + chunk),
+      (runState) => {
+        if (runState === 'done') {
+          setStatus('completed');
+          fetchReports();
+        } else {
+          setError(`Pipeline run ${runState ?? 'not found'}`);
+          setStatus('error');
         }
-      }, 2000);
-    }
+      }
+    );
 
-    return () => clearInterval(interval);
+    return close;
   }, [status, jobId, iteration]);
 
   const fetchReports = async () => {
@@ -79,6 +78,7 @@ function App() {
     try {
       const data = await getQCReports(jobId, iteration, sampleName);
       setReports(data.reports);
+      setEstimated(Boolean(data.estimated));
     } catch (err) {
       console.error("Error fetching reports", err);
     }
@@ -221,6 +221,7 @@ function App() {
                   <option value="full">Full Pipeline</option>
                   <option value="qc_only">QC Only</option>
                   <option value="trim_qc">Trim & QC</option>
+                  <option value="preview">Preview (read subsample)</option>
                 </Select>
               </div>
 
@@ -275,6 +276,11 @@ function App() {
                 <Card className="col-span-3 h-full overflow-hidden flex flex-col border shadow-sm">
                     <CardHeader className="py-4 px-4 border-b bg-gray-50">
                         <CardTitle className="text-base font-semibold text-gray-700">Available Reports</CardTitle>
+                        {estimated && (
+                            <CardDescription className="text-xs text-yellow-700">
+                                Preview: estimated from a read subsample, not a full-run result.
+                            </CardDescription>
+                        )}
                     </CardHeader>
                     <CardContent className="flex-1 overflow-y-auto p-2 space-y-1 bg-gray-50/30">
                         {Object.entries(reports).map(([key]) => {
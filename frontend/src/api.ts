@@ -20,6 +20,87 @@ export const checkHealth = async () => {
   return response.data;
 };
 
+/* -----------------------------
+   RESUMABLE UPLOADS
+   Files are sent as parts (several in flight, each retried) and the
+   upload id is kept in localStorage, so after a dropped connection the
+   same call only sends the parts the server is missing.
+------------------------------ */
+const PART_SIZE = 16 * 1024 * 1024;
+const PART_CONCURRENCY = 4;
+const PART_RETRIES = 3;
+
+const uploadResumable = async (
+  fields: Record<string, string>,
+  file: File
+) => {
+  const resumeKey = `upload:${Object.values(fields).join(":")}:${file.name}:${file.size}:${file.lastModified}`;
+  let uploadId = localStorage.getItem(resumeKey);
+  let partSize = PART_SIZE;
+  let received = new Set<number>();
+
+  if (uploadId) {
+    try {
+      const status = (await api.get(`/uploads/${uploadId}`)).data;
+      if (status.state === "uploading") {
+        partSize = status.part_size;
+        received = new Set(status.received);
+      } else {
+        uploadId = null;
+      }
+    } catch {
+      uploadId = null;
+    }
+  }
+
+  if (!uploadId) {
+    const formData = new FormData();
+    Object.entries(fields).forEach(([key, value]) => formData.append(key, value));
+    formData.append("size", file.size.toString());
+    formData.append("part_size", PART_SIZE.toString());
+
+    const response = await api.post("/uploads", formData, {
+      headers: {
+        "Content-Type": "multipart/form-data",
+      },
+    });
+    uploadId = response.data.upload_id as string;
+    partSize = response.data.part_size;
+    localStorage.setItem(resumeKey, uploadId);
+  }
+
+  const partCount = Math.max(1, Math.ceil(file.size / partSize));
+  const pending: number[] = [];
+  for (let part = 1; part <= partCount; part++) {
+    if (!received.has(part)) pending.push(part);
+  }
+
+  const worker = async () => {
+    while (pending.length) {
+      const part = pending.shift()!;
+      const blob = file.slice((part - 1) * partSize, Math.min(part * partSize, file.size));
+      for (let attempt = 1; ; attempt++) {
+        try {
+          await api.put(`/uploads/${uploadId}/parts/${part}`, blob, {
+            headers: {
+              "Content-Type": "application/octet-stream",
+            },
+          });
+          break;
+        } catch (err) {
+          if (attempt >= PART_RETRIES) throw err;
+        }
+      }
+    }
+  };
+
+  await Promise.all(Array.from({ length: PART_CONCURRENCY }, worker));
+
+  const response = await api.post(`/uploads/${uploadId}/complete`);
+  localStorage.removeItem(resumeKey);
+  return response.data;
+};
+
 /* -----------------------------
    UPLOAD READS
 ------------------------------ */
@@ -28,34 +109,25 @@ export const uploadReads = async (
   r1: File,
   r2: File
 ) => {
-  const formData = new FormData();
-  formData.append("sample", sample);
-  formData.append("r1", r1);
-  formData.append("r2", r2);
-
-  const response = await api.post("/upload-reads", formData, {
-    headers: {
-      "Content-Type": "multipart/form-data",
-    },
-  });
+  // Both mates upload in parallel
+  const [res1, res2] = await Promise.all([
+    uploadResumable({ kind: "reads", sample, mate: "1" }, r1),
+    uploadResumable({ kind: "reads", sample, mate: "2" }, r2),
+  ]);
 
-  return response.data;
+  return {
+    sample,
+    files: [res1.path, res2.path],
+    pattern: res1.pattern,
+  };
 };
 
 /* -----------------------------
    UPLOAD REFERENCE
 ------------------------------ */
 export const uploadReference = async (file: File) => {
-  const formData = new FormData();
-  formData.append("fasta", file);
-
-  const response = await api.post("/upload-ref", formData, {
-    headers: {
-      "Content-Type": "multipart/form-data",
-    },
-  });
-
-  return response.data;
+  const result = await uploadResumable({ kind: "ref", filename: file.name }, file);
+  return { reference: result.path };
 };
 
 /* -----------------------------
@@ -105,6 +177,42 @@ export const runPipeline = async (
   return response.data;
 };
 
+/* -----------------------------
+   RUN STATUS (EXIT CODE + TRACE)
+------------------------------ */
+export const getRunStatus = async (
+  jobId: string,
+  iteration: number
+) => {
+  const response = await api.get(
+    `/jobs/${jobId}/status/${iteration}`
+  );
+  return response.data;
+};
+
+/* -----------------------------
+   QUEUE STATUS / CANCEL RUN
+------------------------------ */
+export const getQueueStatus = async (
+  jobId: string,
+  iteration: number
+) => {
+  const response = await api.get(
+    `/jobs/${jobId}/queue/${iteration}`
+  );
+  return response.data;
+};
+
+export const cancelRun = async (
+  jobId: string,
+  iteration: number
+) => {
+  const response = await api.post(
+    `/jobs/${jobId}/cancel/${iteration}`
+  );
+  return response.data;
+};
+
 /* -----------------------------
    GET LOGS
 ------------------------------ */
@@ -118,6 +226,40 @@ export const getLogs = async (
   return response.data;
 };
 
+/* -----------------------------
+   STREAM LOGS (SERVER-SENT EVENTS)
+   Returns a function that closes the stream.
+------------------------------ */
+export const streamLogs = (
+  jobId: string,
+  iteration: number,
+  onLogs: (chunk: string) => void,
+  onDone: (state: string | null) => void
+) => {
+  const source = new EventSource(
+    `${API_URL}/jobs/${jobId}/logs/${iteration}/stream`
+  );
+
+  source.onmessage = (event) => {
+    onLogs(event.data + "\n");
+  };
+
+  source.addEventListener("done", (event) => {
+    source.close();
+    onDone(JSON.parse((event as MessageEvent).data).state);
+  });
+
+  // The browser retries dropped streams itself; once it gives up (e.g. 404
+  // or 401) the stream is closed and no "done" will ever arrive
+  source.onerror = () => {
+    if (source.readyState === EventSource.CLOSED) {
+      onDone(null);
+    }
+  };
+
+  return () => source.close();
+};
+
 /* -----------------------------
    GET QC REPORTS
 ------------------------------ */
@@ -6,6 +6,7 @@ import { AlertTriangle, CheckCircle, XCircle, Info } from 'lucide-react';
 interface QCResult {
   status: 'PASS' | 'WARN' | 'FAIL' | 'UNKNOWN';
   reason: string;
+  estimated?: boolean;  // Preview runs: only a read subsample was evaluated
 }
 
 interface QCSummaryData {
@@ -51,6 +52,8 @@ export function QCSummary({ url, title }: QCSummaryProps) {
     FAIL: Object.values(data).filter(i => i.status === 'FAIL').length,
   };
 
+  const estimated = Object.values(data).some(i => i.estimated);
+
   const getIcon = (status: string) => {
     switch (status) {
       case 'PASS': return <CheckCircle className="h-5 w-5 text-green-500" />;
@@ -91,6 +94,7 @@ export function QCSummary({ url, title }: QCSummaryProps) {
         <div className="flex items-center justify-between">
           <CardTitle className="text-xl font-semibold">{title}</CardTitle>
           <div className="flex space-x-2">
+             {estimated && <Badge variant="outline" className="text-yellow-700 border-yellow-200 bg-yellow-50">Estimated</Badge>}
              {counts.FAIL > 0 && <Badge variant="destructive">{counts.FAIL} Fails</Badge>}
              {counts.WARN > 0 && <Badge variant="secondary" className="bg-yellow-100 text-yellow-800 hover:bg-yellow-200">{counts.WARN} Warnings</Badge>}
              <Badge variant="outline" className="text-green-600 border-green-200 bg-green-50">{counts.PASS} Passed</Badge>
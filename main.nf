@@ -8,88 +8,251 @@ nextflow.enable.dsl = 2
 params.stage   = 'full'
 params.reads   = null
 params.ref     = null
+// CSV with a header row: sample,fastq_1,fastq_2 (one line per sample).
+// Used instead of --reads to run a whole cohort in one session.
+params.samplesheet = null
 params.outdir  = "${baseDir}/results"
 
 params.qual    = 20
 params.min_len = 36
 
+// FASTQ QC engine: 'falco' (reports evaluated by summary.py) or 'native'
+// (fastq_qc.py streams the FASTQs and evaluates them in one pass)
+params.qc_engine = 'falco'
+
+// Skip the falco pass over the trimmed reads (QC_TRIMMED) and evaluate the
+// after-filtering statistics in fastp's JSON instead (falco engine only)
+params.skip_trimmed_qc = false
+
+// QC summary of the falco reports: 'per_sample' runs summary.py once per
+// sample; 'aggregate' collects the whole run into one QC_SUMMARY_ALL task,
+// which spreads the reports over its own workers and writes the same
+// per-sample tables plus a combined qc_summary/qc_cohort.jsonl
+params.summary_mode = 'per_sample'
+
+// Preview stage: QC of the first preview_reads read pairs of each sample only,
+// for an early (estimated) verdict while the full run is still going
+params.preview_reads = 100000
+
+// Evaluations of unchanged reports are reused from here by summary.py
+params.summary_cache = "${baseDir}/qc_summary_cache"
+
+// minimap2 indexes are built once per reference content, preset and minimap2
+// version and reused from here (see ref_index.py for the layout)
+params.index_cache     = "${baseDir}/ref_index_cache"
+params.minimap2_preset = 'sr'
+// SHA-256 of --ref when already known (the API passes it); otherwise hashed in INDEX_REF
+params.ref_sha256      = null
+
+// Sharded alignment: read pairs per chunk (0 = align each sample as one task).
+// Chunks are aligned and sorted in parallel, then merged before markdup.
+params.shard_size = 0
+
+// Fused alignment: stream minimap2 into fixmate/sort (and markdup) in one task,
+// without writing or publishing the unsorted BAM
+params.fused_align = false
+params.markdup     = true
+
+// Publishing policy. Large artifacts (FASTQs, BAMs) are published with
+// publish_mode, one of PUBLISH_MODES; reports are always copied. 'move' is
+// left out: trimmed reads and BAMs still feed downstream tasks. `publish`
+// lists the output groups to publish (comma-separated or a list), or 'all':
+//   raw_qc, trimmed_reads, fastp, trimmed_qc, qc_summary, alignments, processed, qc_alignment
+// The `lean` profile in nextflow.config combines hardlinks, no intermediates
+// and cleaning work/ after a successful run.
+params.publish_mode = 'copy'
+params.publish      = 'all'
+
+PUBLISH_MODES = ['copy', 'copyNoFollow', 'link', 'rellink']
+
+// params.publish as a list of group names, parsed once
+publishGroups = (params.publish instanceof Collection ? params.publish : params.publish.toString().tokenize(','))
+    .collect { it.toString().trim() }
+
+def publishing(String group) {
+    publishGroups.contains('all') || publishGroups.contains(group)
+}
+
+// Exit status for the API scheduler, which settles runs whose nextflow process
+// it did not start from this file (scheduler.EXIT_STATUS_FILE)
+workflow.onComplete {
+    file("${params.outdir}/exit_status.txt").text = "${workflow.success ? 0 : (workflow.exitStatus ?: 1)}\n"
+}
+
 // ---------------------------
 // WORKFLOW
 // ---------------------------
 workflow {
 
-    if (!params.stage in ['qc_only', 'trim_qc', 'full']) {
-        exit 1, "ERROR: Invalid stage '${params.stage}'. Use qc_only, trim_qc, or full."
+    if (!(params.stage in ['preview', 'qc_only', 'trim_qc', 'full'])) {
+        exit 1, "ERROR: Invalid stage '${params.stage}'. Use preview, qc_only, trim_qc, or full."
+    }
+
+    if (!(params.publish_mode in PUBLISH_MODES)) {
+        exit 1, "ERROR: Invalid publish_mode '${params.publish_mode}'. Use ${PUBLISH_MODES.join(', ')}."
+    }
+
+    if (params.skip_trimmed_qc && params.qc_engine != 'falco') {
+        exit 1, "ERROR: --skip_trimmed_qc only applies to the falco QC engine"
+    }
+
+    if (!(params.summary_mode in ['per_sample', 'aggregate'])) {
+        exit 1, "ERROR: Invalid summary_mode '${params.summary_mode}'. Use per_sample or aggregate."
     }
 
-    if (!params.reads) {
-        exit 1, "ERROR: --reads is required"
+    if (params.stage == 'preview' && params.preview_reads < 1) {
+        exit 1, "ERROR: --preview_reads must be at least 1"
+    }
+
+    if (!(params.qc_engine in ['falco', 'native'])) {
+        exit 1, "ERROR: Invalid qc_engine '${params.qc_engine}'. Use falco or native."
+    }
+
+    if (!params.reads && !params.samplesheet) {
+        exit 1, "ERROR: --reads or --samplesheet is required"
     }
 
     if (params.stage == 'full' && !params.ref) {
         exit 1, "ERROR: --ref is required for full stage"
     }
 
+    if (params.shard_size && params.shard_size * 4 < 1000) {
+        exit 1, "ERROR: --shard_size must be at least 250 read pairs"
+    }
+
     log.info """
     Running pipeline with:
-      stage   = ${params.stage}
-      qual    = ${params.qual}
-      min_len = ${params.min_len}
+      stage      = ${params.stage}
+      qc_engine  = ${params.qc_engine}
+      qual       = ${params.qual}
+      min_len    = ${params.min_len}
+      shard_size = ${params.shard_size ?: 'off'}
+      fused      = ${params.fused_align}
     """
 
-    reads_ch = Channel.fromFilePairs(params.reads, flat: true) {
-        file ->
-            def name = file.name
-            name = name.replaceAll(/\.fastq(?:\.gz)?$/, '')
-            name = name.replaceFirst(/(_R?\d(_\d+)?$)|(-R?\d$)|(_\d$)/, '')
+    if (params.samplesheet) {
+        rows = file(params.samplesheet, checkIfExists: true).splitCsv(header: true)
+
+        // Reports are named after the FASTQ file names: shared names would
+        // overwrite each other in qc_summary and qc_results
+        def repeated = rows.collectMany { row -> [file(row.fastq_1).name, file(row.fastq_2).name] }
+            .countBy { it }
+            .findAll { name, count -> count > 1 }
+            .keySet()
+        if (repeated) {
+            exit 1, "ERROR: samplesheet FASTQ file names must be unique; repeated: ${repeated.join(', ')}"
+        }
+
+        reads_ch = Channel.fromList(rows)
+            .map { row -> tuple(row.sample, file(row.fastq_1, checkIfExists: true), file(row.fastq_2, checkIfExists: true)) }
+    } else {
+        reads_ch = Channel.fromFilePairs(params.reads, flat: true) {
+            file ->
+                def name = file.name
+                name = name.replaceAll(/\.fastq(?:\.gz)?$/, '')
+                name = name.replaceFirst(/(_R?\d(_\d+)?$)|(-R?\d$)|(_\d$)/, '')
+        }
     }
 
     // ---------------------------
-    // STAGE 1: QC ONLY
+    // STAGE 1: QC ONLY (OR PREVIEW)
     // ---------------------------
-    if (params.stage == 'qc_only') {
-        QC(reads_ch)
+    if (params.stage in ['qc_only', 'preview']) {
+        qc_reads = params.stage == 'preview' ? SUBSAMPLE_READS(reads_ch) : reads_ch
+
+        if (params.qc_engine == 'native') {
+            native_qc = QC_NATIVE(qc_reads.map { sample_id, read1, read2 -> tuple(sample_id, 'raw', read1, read2) })
+            QC_SUMMARY_NATIVE(native_qc.cohort.groupTuple(size: 1))
+        } else {
+            raw_qc = QC(qc_reads)
+            if (params.stage == 'preview') {
+                QC_SUMMARY_RAW(raw_qc)
+            }
+        }
         return
     }
 
     // ---------------------------
     // STAGE 2: QC + TRIM + QC
     // ---------------------------
-    if (params.stage == 'trim_qc') {
+    trimmed = TRIM_QC(reads_ch)
+
+    if (params.qc_engine == 'native') {
+        // Raw and trimmed reads go through the same process, tagged by stage
+        qc_reads = reads_ch.map { sample_id, read1, read2 -> tuple(sample_id, 'raw', read1, read2) }
+            .mix(trimmed.trimmed_reads.map { sample_id, read1, read2 -> tuple(sample_id, 'trimmed', read1, read2) })
 
+        native_qc = QC_NATIVE(qc_reads)
+
+        QC_SUMMARY_NATIVE(native_qc.cohort.groupTuple(size: 2))
+    } else {
         raw_qc = QC(reads_ch)
 
-        trimmed = TRIM_QC(reads_ch)
+        if (params.skip_trimmed_qc) {
+            qc_dirs = raw_qc.map { sample_id, raw -> tuple(sample_id, [raw]) }
+        } else {
+            trim_qc = QC_TRIMMED(trimmed.trimmed_reads)
+
+            qc_dirs = raw_qc.join(trim_qc).map { sample_id, raw, trim -> tuple(sample_id, [raw, trim]) }
+        }
 
-        trim_qc = QC_TRIMMED(trimmed.trimmed_reads)
+        qc_inputs = qc_dirs.join(trimmed.fastp_json)
 
-        qc_inputs = raw_qc.join(trim_qc).join(trimmed.fastp_json)
+        if (params.summary_mode == 'aggregate') {
+            // Which staged reports belong to which sample
+            sample_map = qc_inputs
+                .map { sample_id, dirs, fastp_json -> ([sample_id] + dirs*.name + [fastp_json.name]).join('\t') }
+                .collectFile(name: 'qc_samples.tsv', newLine: true, sort: true)
 
-        QC_SUMMARY(qc_inputs)
+            qc_files = qc_inputs
+                .flatMap { sample_id, dirs, fastp_json -> dirs + [fastp_json] }
+                .collect()
 
+            QC_SUMMARY_ALL(qc_files, sample_map)
+        } else {
+            QC_SUMMARY(qc_inputs)
+        }
+    }
+
+    if (params.stage == 'trim_qc') {
         return
     }
 
     // ---------------------------
     // STAGE 3: FULL PIPELINE
     // ---------------------------
-    raw_qc = QC(reads_ch)
-
-    trimmed = TRIM_QC(reads_ch)
-
-    trim_qc = QC_TRIMMED(trimmed.trimmed_reads)
-
-    qc_inputs = raw_qc.join(trim_qc).join(trimmed.fastp_json)
-
-    QC_SUMMARY(qc_inputs)
-
     ref_ch = Channel.value(file(params.ref))
 
-    refidx = INDEX_REF(ref_ch)
-
-    mapped = ALIGN(trimmed.trimmed_reads, refidx)
-
-    final_bam = POSTPROCESS(mapped)
+    refidx = INDEX_REF(ref_ch, params.ref_sha256 ?: '')
+
+    if (params.shard_size) {
+        // Scatter: one (sample_id, shard, R1, R2) item per chunk. fastp names
+        // chunks <index>.<name>; mates are paired by that index, not glob order.
+        // The sample id carries its chunk count (groupKey), so each sample is
+        // gathered as soon as its own chunks are aligned.
+        shards = SPLIT_READS(trimmed.trimmed_reads)
+            .flatMap { sample_id, r1s, r2s ->
+                def byIndex = { files -> (files instanceof Collection ? files : [files]).sort { it.name.tokenize('.')[0] as int } }
+                def read1s = byIndex(r1s)
+                def read2s = byIndex(r2s)
+                if (read1s.size() != read2s.size()) {
+                    error "SPLIT_READS produced ${read1s.size()} R1 and ${read2s.size()} R2 chunks for ${sample_id}"
+                }
+                def key = groupKey(sample_id, read1s.size())
+                [read1s, read2s].transpose().collect { read1, read2 -> tuple(key, read1.name.tokenize('.')[0], read1, read2) }
+            }
+
+        // Gather: all sorted chunks of a sample
+        sorted_shards = ALIGN_SHARD(shards, refidx).groupTuple()
+
+        final_bam = MERGE_SHARDS(sorted_shards)
+    } else if (params.fused_align) {
+        final_bam = ALIGN_SORT(trimmed.trimmed_reads, refidx)
+    } else {
+        mapped = ALIGN(trimmed.trimmed_reads, refidx)
+
+        final_bam = POSTPROCESS(mapped)
+    }
 
     FLAGSTAT(final_bam)
 }
@@ -98,11 +261,33 @@ workflow {
 // PROCESS DEFINITIONS
 // ---------------------------
 
+process SUBSAMPLE_READS {
+    tag "$sample_id"
+    label 'process_single'
+
+    input:
+        tuple val(sample_id), path(read1), path(read2)
+
+    output:
+        tuple val(sample_id),
+              path("${sample_id}_R1.preview.fastq.gz"),
+              path("${sample_id}_R2.preview.fastq.gz")
+
+    script:
+    // Head sample: head closes the pipe after preview_reads records, which
+    // stops the decompression, so the cost does not grow with the input
+    def lines = params.preview_reads * 4
+    """
+    zcat -f ${read1} | head -n ${lines} | gzip -1 > ${sample_id}_R1.preview.fastq.gz &
+    zcat -f ${read2} | head -n ${lines} | gzip -1 > ${sample_id}_R2.preview.fastq.gz
+    wait \$!
+    """
+}
+
 process QC {
     tag "$sample_id"
-    cpus 2
-    memory '2 GB'
-    publishDir "${params.outdir}/falco_raw", mode: 'copy'
+    label 'process_low'
+    publishDir "${params.outdir}/falco_raw", mode: 'copy', enabled: publishing('raw_qc')
 
     input:
         tuple val(sample_id), path(read1), path(read2)
@@ -119,9 +304,9 @@ process QC {
 
 process TRIM_QC {
     tag "$sample_id"
-    cpus 4
-    memory '3 GB'
-    publishDir "${params.outdir}/trimmed_reads", mode: 'copy'
+    label 'process_medium'
+    publishDir "${params.outdir}/trimmed_reads", mode: params.publish_mode, pattern: '*.fastq.gz', enabled: publishing('trimmed_reads')
+    publishDir "${params.outdir}/trimmed_reads", mode: 'copy', pattern: '*.fastp.*', enabled: publishing('fastp')
 
     input:
         tuple val(sample_id), path(read1), path(read2)
@@ -152,9 +337,8 @@ process TRIM_QC {
 
 process QC_TRIMMED {
     tag "$sample_id"
-    cpus 2
-    memory '2 GB'
-    publishDir "${params.outdir}/falco_trimmed", mode: 'copy'
+    label 'process_low'
+    publishDir "${params.outdir}/falco_trimmed", mode: 'copy', enabled: publishing('trimmed_qc')
 
     input:
         tuple val(sample_id), path(read1), path(read2)
@@ -171,45 +355,152 @@ process QC_TRIMMED {
 
 process QC_SUMMARY {
     tag "$sample_id"
-    publishDir "${params.outdir}/qc_summary", mode: 'copy'
+    label 'process_low'
+    publishDir "${params.outdir}/qc_summary", mode: 'copy', enabled: publishing('qc_summary')
 
     input:
-        tuple val(sample_id), path(raw_qc_dir), path(trim_qc_dir), path(fastp_json)
+        tuple val(sample_id), path(qc_dirs), path(fastp_json)
 
     output:
         path "*.json"
+        path "${sample_id}.qc_cohort.jsonl"
 
     script:
+    // Without QC_TRIMMED, the trimmed reads are evaluated from fastp's JSON
+    def fastp = params.skip_trimmed_qc ? '--fastp' : ''
     """
     cp ${baseDir}/summary.py .
-    python3 summary.py
+    python3 summary.py --workers $task.cpus --cache-dir ${params.summary_cache} \
+      --cohort ${sample_id}.qc_cohort.jsonl ${fastp}
     
     mv qc_results/*.json .
     """
 }
 
+process QC_SUMMARY_RAW {
+    tag "$sample_id"
+    label 'process_single'
+    publishDir "${params.outdir}/qc_summary", mode: 'copy', enabled: publishing('qc_summary')
+
+    input:
+        tuple val(sample_id), path(raw_qc_dir)
+
+    output:
+        path "*.json"
+        path "${sample_id}.qc_cohort.jsonl"
+
+    script:
+    // Preview outcomes only cover a read subsample
+    def estimated = params.stage == 'preview' ? '--estimated' : ''
+    """
+    cp ${baseDir}/summary.py .
+    python3 summary.py --workers $task.cpus --cache-dir ${params.summary_cache} \
+      --cohort ${sample_id}.qc_cohort.jsonl ${estimated}
+
+    mv qc_results/*.json .
+    """
+}
+
+process QC_NATIVE {
+    tag "$sample_id:$stage"
+    label 'process_low'
+    // Evaluated reports land next to QC_SUMMARY's, where the API lists them
+    publishDir "${params.outdir}/qc_summary", mode: 'copy', pattern: '*_report.json', enabled: publishing('qc_summary')
+
+    input:
+        tuple val(sample_id), val(stage), path(read1), path(read2)
+
+    output:
+        path "*_report.json"
+        tuple val(sample_id), path("${sample_id}.${stage}.qc_cohort.jsonl"), emit: cohort
+
+    script:
+    // Preview outcomes only cover a read subsample
+    def estimated = params.stage == 'preview' ? '--estimated' : ''
+    """
+    cp ${baseDir}/summary.py ${baseDir}/fastq_qc.py .
+    python3 fastq_qc.py profile --stage ${stage} -t $task.cpus --outdir . ${estimated} \
+      --cohort ${sample_id}.${stage}.qc_cohort.jsonl ${read1} ${read2}
+    """
+}
+
+process QC_SUMMARY_NATIVE {
+    tag "$sample_id"
+    label 'process_single'
+    publishDir "${params.outdir}/qc_summary", mode: 'copy', enabled: publishing('qc_summary')
+
+    input:
+        tuple val(sample_id), path(cohorts)
+
+    output:
+        path "${sample_id}.qc_cohort.jsonl"
+
+    script:
+    // Same combined table as QC_SUMMARY writes for the falco reports
+    """
+    cp ${baseDir}/summary.py ${baseDir}/fastq_qc.py .
+    python3 fastq_qc.py merge --cohort ${sample_id}.qc_cohort.jsonl ${cohorts}
+    """
+}
+
+process QC_SUMMARY_ALL {
+    tag 'all'
+    label 'process_medium'
+    publishDir "${params.outdir}/qc_summary", mode: 'copy', enabled: publishing('qc_summary')
+
+    input:
+        path qc_files, stageAs: 'qc/*'
+        path sample_map
+
+    output:
+        path "*.json"
+        path "*qc_cohort.jsonl"
+
+    script:
+    def fastp = params.skip_trimmed_qc ? '--fastp' : ''
+    """
+    cp ${baseDir}/summary.py .
+    python3 summary.py qc --workers $task.cpus --cache-dir ${params.summary_cache} \
+      --samples ${sample_map} --sample-cohort '{sample}.qc_cohort.jsonl' \
+      --cohort qc_cohort.jsonl ${fastp}
+
+    mv qc_results/*.json .
+    """
+}
+
 process INDEX_REF {
-    cpus 2
-    memory '2 GB'
-    publishDir "${params.outdir}/reference", mode: 'copy'
+    label 'process_low'
 
     input:
         path ref
+        val ref_sha256
 
     output:
         path "reference.mmi"
 
     script:
     """
-    minimap2 -d reference.mmi ${ref}
+    sha=${ref_sha256}
+    [ -n "\$sha" ] || sha=\$(sha256sum ${ref} | cut -d' ' -f1)
+    version=\$(minimap2 --version)
+    cache=${params.index_cache}/\${sha}-${params.minimap2_preset}-minimap2_\${version}
+
+    if [ ! -s \$cache/reference.mmi ]; then
+        mkdir -p \$cache
+        minimap2 -x ${params.minimap2_preset} -d \$cache/reference.mmi.tmp.\$\$ ${ref}
+        mv \$cache/reference.mmi.tmp.\$\$ \$cache/reference.mmi
+        printf '{"ref_sha256": "%s", "ref_name": "%s", "preset": "%s", "minimap2_version": "%s"}\\n' \\
+          "\$sha" "${ref.name}" "${params.minimap2_preset}" "\$version" > \$cache/meta.json
+    fi
+
+    ln -s \$cache/reference.mmi reference.mmi
     """
 }
 
 process ALIGN {
     tag "$sample_id"
-    cpus 4
-    memory '5 GB'
-    publishDir "${params.outdir}/alignments", mode: 'copy'
+    label 'process_high'
+    publishDir "${params.outdir}/alignments", mode: params.publish_mode, enabled: publishing('alignments')
 
     input:
         tuple val(sample_id), path(read1), path(read2)
@@ -220,16 +511,15 @@ process ALIGN {
 
     script:
     """
-    minimap2 -t $task.cpus -ax sr ${ref_idx} ${read1} ${read2} | \
+    minimap2 -t $task.cpus -ax ${params.minimap2_preset} ${ref_idx} ${read1} ${read2} | \
       sambamba view -S -f bam /dev/stdin -o ${sample_id}.bam
     """
 }
 
 process POSTPROCESS {
     tag "$sample_id"
-    cpus 4
-    memory '3 GB'
-    publishDir "${params.outdir}/processed", mode: 'copy'
+    label 'process_medium'
+    publishDir "${params.outdir}/processed", mode: params.publish_mode, enabled: publishing('processed')
 
     input:
         tuple val(sample_id), path(bam)
@@ -247,11 +537,112 @@ process POSTPROCESS {
     """
 }
 
+process ALIGN_SORT {
+    tag "$sample_id"
+    label 'process_high'
+    publishDir "${params.outdir}/processed", mode: params.publish_mode, enabled: publishing('processed')
+
+    input:
+        tuple val(sample_id), path(read1), path(read2)
+        path ref_idx
+
+    output:
+        tuple val(sample_id),
+              path("${sample_id}.sorted*.bam"),
+              path("${sample_id}.sorted*.bam.bai")
+
+    script:
+    // minimap2 emits mates next to each other, so fixmate needs no collate.
+    // Everything between minimap2 and the final BAM stays in the pipe (-u).
+    if (params.markdup)
+        """
+        minimap2 -t $task.cpus -ax ${params.minimap2_preset} ${ref_idx} ${read1} ${read2} | \
+          samtools fixmate -m -u - - | \
+          samtools sort -u -@ $task.cpus - | \
+          samtools markdup -@ $task.cpus --write-index - ${sample_id}.sorted.marked.bam##idx##${sample_id}.sorted.marked.bam.bai
+        """
+    else
+        """
+        minimap2 -t $task.cpus -ax ${params.minimap2_preset} ${ref_idx} ${read1} ${read2} | \
+          samtools sort -@ $task.cpus --write-index -o ${sample_id}.sorted.bam##idx##${sample_id}.sorted.bam.bai -
+        """
+}
+
+process SPLIT_READS {
+    tag "$sample_id"
+    label 'process_low'
+
+    input:
+        tuple val(sample_id), path(read1), path(read2)
+
+    output:
+        tuple val(sample_id),
+              path("*.${sample_id}_R1.shard.fastq.gz"),
+              path("*.${sample_id}_R2.shard.fastq.gz")
+
+    script:
+    // Reads are already trimmed: fastp only splits (all filters disabled)
+    """
+    fastp \
+      --in1 ${read1} --in2 ${read2} \
+      --out1 ${sample_id}_R1.shard.fastq.gz \
+      --out2 ${sample_id}_R2.shard.fastq.gz \
+      --split_by_lines ${params.shard_size * 4} \
+      --split_prefix_digits 4 \
+      -A -G -Q -L \
+      --json /dev/null --html /dev/null \
+      -w $task.cpus
+    """
+}
+
+process ALIGN_SHARD {
+    tag "$sample_id:$shard"
+    label 'process_high'
+
+    input:
+        tuple val(sample_id), val(shard), path(read1), path(read2)
+        path ref_idx
+
+    output:
+        tuple val(sample_id), path("${sample_id}.${shard}.sorted.bam")
+
+    script:
+    """
+    minimap2 -t $task.cpus -ax ${params.minimap2_preset} ${ref_idx} ${read1} ${read2} | \
+      samtools sort -@ $task.cpus -o ${sample_id}.${shard}.sorted.bam -
+    """
+}
+
+process MERGE_SHARDS {
+    tag "$sample_id"
+    label 'process_medium'
+    publishDir "${params.outdir}/processed", mode: params.publish_mode, enabled: publishing('processed')
+
+    input:
+        tuple val(sample_id), path(bams)
+
+    output:
+        tuple val(sample_id),
+              path("${sample_id}.sorted.marked.bam"),
+              path("${sample_id}.sorted.marked.bam.bai")
+
+    script:
+    // Shards are already sorted, so a merge replaces POSTPROCESS's full sort
+    def shards = bams instanceof Collection ? bams : [bams]
+    def merge = shards.size() > 1
+        ? "sambamba merge -t $task.cpus ${sample_id}.sorted.bam ${shards.join(' ')}"
+        : "mv ${shards[0]} ${sample_id}.sorted.bam"
+    """
+    ${merge}
+    sambamba markdup -t $task.cpus ${sample_id}.sorted.bam ${sample_id}.sorted.marked.bam
+    sambamba index ${sample_id}.sorted.marked.bam
+    """
+}
+
 process FLAGSTAT {
     tag "$sample_id"
-    cpus 1
-    memory '1 GB'
-    publishDir "${params.outdir}/qc_alignment", mode: 'copy'
+    label 'process_single'
+    publishDir "${params.outdir}/qc_alignment", mode: 'copy', enabled: publishing('qc_alignment')
 
     input:
         tuple val(sample_id), path(bam), path(bai)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import List
+
+# Same layout as INDEX_REF in main.nf:
+#   <cache_dir>/<ref sha256>-<preset>-minimap2_<version>/reference.mmi (+ meta.json)
+INDEX_FILE = "reference.mmi"
+META_FILE = "meta.json"
+DEFAULT_PRESET = "sr"
+# What index_key produces; anything else never names a cache entry
+KEY_PATTERN = re.compile(r"^[0-9a-f]{64}-[A-Za-z0-9_.-]+-minimap2_[^/]+$")
+
+_building = set()
+_building_lock = threading.Lock()
+
+
+class IndexBuildError(RuntimeError):
+    """minimap2 is unavailable or failed to build an index"""
+
+
+# -------------------------------------------------
+# CACHE KEYS
+# -------------------------------------------------
+@lru_cache(maxsize=1)
+def minimap2_version() -> str:
+    try:
+        out = subprocess.run(["minimap2", "--version"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise IndexBuildError(f"minimap2 is not available: {e}")
+    return out.stdout.strip()
+
+
+def index_key(ref_sha256: str, preset: str, version: str) -> str:
+    return f"{ref_sha256}-{preset}-minimap2_{version}"
+
+
+def file_sha256(path: str, chunk_size: int = 4 * 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# -------------------------------------------------
+# LISTING
+# -------------------------------------------------
+def index_info(cache_dir: str, key: str) -> dict:
+    entry_dir = os.path.join(cache_dir, key)
+    index_path = os.path.join(entry_dir, INDEX_FILE)
+    info = {"key": key}
+    try:
+        with open(os.path.join(entry_dir, META_FILE)) as f:
+            info.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+    if os.path.exists(index_path):
+        info.update(state="ready", path=index_path, size=os.path.getsize(index_path))
+    else:
+        info["state"] = "building" if key in _building else "missing"
+    return info
+
+
+def list_indexes(cache_dir: str) -> List[dict]:
+    if not os.path.isdir(cache_dir):
+        return []
+    keys = sorted(
+        name for name in os.listdir(cache_dir)
+        if os.path.isdir(os.path.join(cache_dir, name))
+    )
+    return [index_info(cache_dir, key) for key in keys]
+
+
+# -------------------------------------------------
+# BUILDING
+# -------------------------------------------------
+def claim_build(key: str) -> bool:
+    """Mark `key` as being built here; False if a build is already running"""
+    with _building_lock:
+        if key in _building:
+            return False
+        _building.add(key)
+        return True
+
+
+def build_index(cache_dir: str, key: str, ref_path: str, ref_sha256: str, preset: str) -> None:
+    """Build one cached index (after claim_build). The .mmi is written under a
+    temporary name and renamed, so readers only ever see a complete index."""
+    entry_dir = os.path.join(cache_dir, key)
+    index_path = os.path.join(entry_dir, INDEX_FILE)
+    try:
+        if os.path.exists(index_path):
+            return
+        os.makedirs(entry_dir, exist_ok=True)
+        tmp = f"{index_path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        try:
+            subprocess.run(["minimap2", "-x", preset, "-d", tmp, ref_path], capture_output=True, check=True)
+            os.replace(tmp, index_path)
+        except (OSError, subprocess.CalledProcessError) as e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            print(f"Failed to build index {key}: {e}")
+            return
+
+        meta = {
+            "ref_sha256": ref_sha256,
+            "ref_name": os.path.basename(ref_path),
+            "preset": preset,
+            "minimap2_version": minimap2_version(),
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        with open(os.path.join(entry_dir, META_FILE), "w") as f:
+            json.dump(meta, f)
+    finally:
+        with _building_lock:
+            _building.discard(key)
+
+
+def entry_path(cache_dir: str, key: str):
+    """Directory of a cache entry, or None unless `key` is a well-formed key
+    naming a direct child of `cache_dir`"""
+    if not KEY_PATTERN.match(key):
+        return None
+    entry_dir = os.path.realpath(os.path.join(cache_dir, key))
+    if os.path.dirname(entry_dir) != os.path.realpath(cache_dir):
+        return None
+    return entry_dir
+
+
+def remove_index(cache_dir: str, key: str) -> bool:
+    entry_dir = entry_path(cache_dir, key)
+    if entry_dir is None or not os.path.isdir(entry_dir) or key in _building:
+        return False
+    for name in os.listdir(entry_dir):
+        os.remove(os.path.join(entry_dir, name))
+    os.rmdir(entry_dir)
+    return True
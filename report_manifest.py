@@ -0,0 +1,205 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from database import Run
+from run_status import TRACE_FILE, parse_trace, sample_tasks
+from scheduler import PREVIEW_STAGE
+from summary import cohort_index
+
+# Written into a finished run's outdir, so no API worker has to scan it again
+MANIFEST_FILE = "report_manifest.json"
+# Bumped when the manifest content changes, so older manifests are rebuilt
+MANIFEST_VERSION = 3
+MANIFEST_CACHE_SIZE = int(os.getenv("PIPELINE_MANIFEST_CACHE_SIZE", "256"))
+
+
+# -------------------------------------------------
+# SCANNING
+# -------------------------------------------------
+def _mate_label(prefix: str, name: str, reports: dict) -> str:
+    label = prefix
+    if "_1" in name or "_R1" in name:
+        label += "_R1"
+    elif "_2" in name or "_R2" in name:
+        label += "_R2"
+    if label in reports:
+        label += f"_{name}"
+    return label
+
+
+def sample_read_names(sample: str, reads: Iterable[str] = ()) -> set:
+    """File names of the FASTQs a sample's reports are named after: its input
+    `reads` and the trimmed and preview reads main.nf writes for it"""
+    names = {os.path.basename(path) for path in reads}
+    for mate in ("R1", "R2"):
+        names.add(f"{sample}_{mate}.trimmed.fastq.gz")
+        names.add(f"{sample}_{mate}.preview.fastq.gz")
+    return names
+
+
+def report_read(report_json: str) -> str:
+    """FASTQ a Summary JSON evaluates, e.g.
+    ecoli_R1.trimmed.fastq.gz_Trimmed_report.json -> ecoli_R1.trimmed.fastq.gz"""
+    return report_json[:-len("_report.json")].rsplit("_", 1)[0]
+
+
+def sample_reports(run: Run, sample: str, resumed: Dict[str, int],
+                   outdir_of: Callable[[int], Path], reads: Iterable[str] = ()) -> dict:
+    """Reports of one sample of a run: {"reports": {label: url}, "reused":
+    {subdir: iteration}, "estimated": bool}. Reports of tasks resumed from an
+    earlier iteration (`resumed`, task name -> iteration) link to that
+    iteration's outdir. Reports of preview runs only cover a read subsample
+    and are marked estimated.
+
+    Summary JSONs are matched to the sample by the FASTQs they evaluate: its
+    `reads` (e.g. from the sample sheet), or, when those are not known, the
+    sample naming main.nf applies to --reads pairs."""
+    outdir = Path(run.outdir)
+    reports = {}
+    reused = {}
+    reads = list(reads)
+    read_names = sample_read_names(sample, reads)
+
+    def own_report(report_json: str) -> bool:
+        read = report_read(report_json)
+        return read in read_names or (not reads and cohort_index(f"{read} (Raw)")[0] == sample)
+
+    def source(process: str, subdir: str) -> Tuple[Path, int]:
+        origin = resumed.get(f"{process} ({sample})")
+        if origin is not None:
+            origin_dir = outdir_of(origin)
+            if (origin_dir / subdir).exists():
+                reused[subdir] = origin
+                return origin_dir, origin
+        return outdir, run.iteration
+
+    def url(base: Path, iteration: int, path: Path) -> str:
+        return f"/qc/{run.job_id}/{iteration}/{path.relative_to(base)}"
+
+    # -------- fastp --------
+    base, it = source("TRIM_QC", "trimmed_reads")
+    fastp = base / "trimmed_reads" / f"{sample}.fastp.html"
+    if fastp.exists():
+        reports["fastp"] = url(base, it, fastp)
+
+    # -------- falco raw / trimmed --------
+    for process, subdir, report_dir in (
+        ("QC", "falco_raw", f"{sample}_falco_report"),
+        ("QC_TRIMMED", "falco_trimmed", f"{sample}_falco_trimmed"),
+    ):
+        base, it = source(process, subdir)
+        falco = base / subdir / report_dir
+        if falco.exists():
+            for html in sorted(falco.glob("*_fastqc_report.html")):
+                reports[_mate_label(subdir, html.name, reports)] = url(base, it, html)
+
+    # -------- qc summary --------
+    base, it = source("QC_SUMMARY", "qc_summary")
+    qc_summary_dir = base / "qc_summary"
+    if qc_summary_dir.exists():
+        # e.g. ecoli_R1.trimmed.fastq.gz_Trimmed_report.json
+        for j in sorted(qc_summary_dir.glob("*_report.json")):
+            if not own_report(j.name):
+                continue
+            name = j.name.replace("_report.json", "")
+            reports[f"Summary JSON ({name})"] = url(base, it, j)
+
+        # One table with every report of the sample (summary.py --cohort)
+        cohort = qc_summary_dir / f"{sample}.qc_cohort.jsonl"
+        if cohort.exists():
+            reports["Cohort Summary"] = url(base, it, cohort)
+
+    return {"reports": reports, "reused": reused, "estimated": run.stage == PREVIEW_STAGE}
+
+
+def run_samples(run: Run, expected: Iterable[str] = ()) -> set:
+    """Samples of a run: those `expected` (e.g. its sample sheet), in its
+    trace, or with a published falco report"""
+    outdir = Path(run.outdir)
+    expected = set(expected)
+    samples = expected | set(sample_tasks(parse_trace(outdir / TRACE_FILE), expected))
+    raw = outdir / "falco_raw"
+    if raw.is_dir():
+        samples.update(p.name[:-len("_falco_report")] for p in raw.glob("*_falco_report"))
+    return samples
+
+
+# -------------------------------------------------
+# MANIFEST
+# -------------------------------------------------
+def run_stamp(run: Run) -> list:
+    """Changes whenever the run changes state (or the manifest format); a
+    manifest built for another stamp is stale"""
+    return [MANIFEST_VERSION, run.state, run.finished_at.isoformat() if run.finished_at else None]
+
+
+def build_manifest(run: Run, samples: Iterable[str], resumed: Dict[str, int],
+                   outdir_of: Callable[[int], Path],
+                   reads: Optional[Dict[str, List[str]]] = None) -> dict:
+    """Reports of every sample; `reads` maps samples to their input FASTQs"""
+    reads = reads or {}
+    manifest = {
+        "job_id": run.job_id, "iteration": run.iteration, "stamp": run_stamp(run),
+        "estimated": run.stage == PREVIEW_STAGE, "samples": {}
+    }
+    for sample in sorted(samples):
+        entry = sample_reports(run, sample, resumed, outdir_of, reads.get(sample, ()))
+        if entry["reports"]:
+            manifest["samples"][sample] = entry
+    return manifest
+
+
+def read_manifest(run: Run) -> Optional[dict]:
+    try:
+        with open(Path(run.outdir) / MANIFEST_FILE) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("stamp") == run_stamp(run) else None
+
+
+def write_manifest(run: Run, manifest: dict) -> None:
+    path = Path(run.outdir) / MANIFEST_FILE
+    # Write then rename so concurrent readers never see a partial manifest
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+class ManifestCache:
+    """In-memory LRU of report manifests keyed by (job_id, iteration). An
+    entry is only returned while the run still has the stamp it was built for."""
+
+    def __init__(self, max_entries: int = MANIFEST_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int], dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, run: Run) -> Optional[dict]:
+        key = (run.job_id, run.iteration)
+        with self._lock:
+            manifest = self._entries.get(key)
+            if manifest is None:
+                return None
+            if manifest["stamp"] != run_stamp(run):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return manifest
+
+    def put(self, manifest: dict) -> None:
+        key = (manifest["job_id"], manifest["iteration"])
+        with self._lock:
+            self._entries[key] = manifest
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, job_id: str, iteration: int) -> None:
+        with self._lock:
+            self._entries.pop((job_id, iteration), None)
@@ -0,0 +1,71 @@
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import psutil
+
+from store import expand_pattern
+
+# Resource profiles in nextflow.config, smallest first
+RESOURCE_PROFILES = ("small", "medium", "large", "hpc", "slurm_local")
+AUTO = "auto"
+
+# Local tiers: (profile, min host cpus, min host memory GB, min input GB).
+# A run gets the largest tier both the host and its input size call for.
+LOCAL_TIERS = (
+    ("large", 64, 256, 50),
+    ("medium", 16, 64, 2),
+    ("small", 0, 0, 0),
+)
+
+# Profiles run by the local executor, capped at this host's cpus/memory
+LOCAL_PROFILES = ("small", "medium", "large", "slurm_local")
+
+# Per-task caps (cpus, memory GB) the profiles set in nextflow.config
+PROFILE_LIMITS = {
+    "small": (4, 8),
+    "medium": (16, 64),
+    "large": (64, 256),
+    "hpc": (64, 256),
+    "slurm_local": (64, 256),
+}
+
+GB = 1024 ** 3
+
+
+def input_bytes(reads_pattern: Optional[str], ref_path: Optional[str], reads_files: Sequence[str] = ()) -> int:
+    files = expand_pattern(reads_pattern) if reads_pattern else []
+    files.extend(reads_files)
+    if ref_path:
+        files.append(ref_path)
+    return sum(os.path.getsize(f) for f in files if os.path.isfile(f))
+
+
+def host_limits() -> Tuple[int, int]:
+    """(cpus, memory bytes) of this host"""
+    return psutil.cpu_count() or 1, psutil.virtual_memory().total
+
+
+def auto_profile(size: int, cpus: int, memory: int) -> str:
+    host_tier = next(i for i, (_, c, m, _) in enumerate(LOCAL_TIERS) if cpus >= c and memory >= m * GB)
+    input_tier = next(i for i, (_, _, _, g) in enumerate(LOCAL_TIERS) if size >= g * GB)
+    return LOCAL_TIERS[max(host_tier, input_tier)][0]
+
+
+def resource_args(profile: str, reads_pattern: Optional[str], ref_path: Optional[str],
+                  reads_files: Sequence[str] = ()) -> Tuple[str, List[str]]:
+    """Resolve `profile` ("auto" picks one from the host and the input size)
+    and return it with the nextflow arguments capping tasks at the smaller
+    of the profile's limits and this host. Command-line params override the
+    profile's, so they must never exceed them."""
+    cpus, memory = host_limits()
+    if profile == AUTO:
+        profile = auto_profile(input_bytes(reads_pattern, ref_path, reads_files), cpus, memory)
+
+    args = []
+    if profile in LOCAL_PROFILES:
+        max_cpus, max_memory = PROFILE_LIMITS[profile]
+        args = [
+            "--max_cpus", str(min(cpus, max_cpus)),
+            "--max_memory", f"{min(max(1, memory // GB), max_memory)}.GB",
+        ]
+    return profile, args
@@ -0,0 +1,178 @@
+import csv
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from database import Run
+from scheduler import PREVIEW_STAGE
+
+# Nextflow writes one row per finished task here (see `trace` in nextflow.config)
+TRACE_FILE = "trace.txt"
+
+# path -> ((mtime, size), tasks); a trace is only re-read when it changes
+_trace_cache: Dict[str, tuple] = {}
+
+
+# -------------------------------------------------
+# TRACE PARSING
+# -------------------------------------------------
+def parse_trace(path: Path) -> List[dict]:
+    """Tasks recorded in a Nextflow trace.txt (tab-separated, header row).
+
+    Each task is returned as {"task_id", "name", "status", "exit", ...} with
+    every column of the trace; "-" values become None.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return []
+
+    signature = (st.st_mtime_ns, st.st_size)
+    cached = _trace_cache.get(str(path))
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    tasks = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            tasks.append({key: (None if value in ("-", "") else value) for key, value in row.items()})
+
+    _trace_cache[str(path)] = (signature, tasks)
+    return tasks
+
+
+def summarize_tasks(tasks: List[dict]) -> Dict[str, int]:
+    """Task counts per Nextflow status (COMPLETED, FAILED, CACHED, ABORTED)"""
+    counts: Dict[str, int] = {}
+    for task in tasks:
+        status = task.get("status") or "UNKNOWN"
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+# -------------------------------------------------
+# PER-SAMPLE PROGRESS (BATCH RUNS)
+# -------------------------------------------------
+# Trace task names are "PROCESS (tag)"; every per-sample process is tagged
+# with the sample id ("sample:shard" for ALIGN_SHARD)
+TASK_NAME = re.compile(r"^(?P<process>\S+) \((?P<tag>.+)\)$")
+# Processes run once per run, not per sample (untagged ones are named "PROCESS (1)")
+RUN_WIDE_PROCESSES = {"INDEX_REF", "QC_SUMMARY_ALL"}
+STATUS_ORDER = ("FAIL", "WARN", "PASS")
+
+
+def sample_tasks(tasks: List[dict], known: Optional[Iterable[str]] = None) -> Dict[str, List[dict]]:
+    """Per-sample tasks by sample; with `known`, tasks of other tags are dropped"""
+    known = set(known) if known else None
+    samples: Dict[str, List[dict]] = {}
+    for task in tasks:
+        match = TASK_NAME.match(task.get("name") or "")
+        if not match or match.group("process") in RUN_WIDE_PROCESSES:
+            continue
+        sample = match.group("tag").split(":", 1)[0]
+        if known is None or sample in known:
+            samples.setdefault(sample, []).append(dict(task, process=match.group("process")))
+    return samples
+
+
+def sample_qc(outdir: Path, sample: str) -> Optional[dict]:
+    """Worst rule outcome and outcome counts from the sample's QC cohort table
+    (qc_summary/<sample>.qc_cohort.jsonl), or None before QC_SUMMARY ran"""
+    path = outdir / "qc_summary" / f"{sample}.qc_cohort.jsonl"
+    if not path.exists():
+        return None
+
+    counts: Dict[str, int] = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for key, value in json.loads(line).items():
+                if key.endswith("_status"):
+                    counts[value] = counts.get(value, 0) + 1
+
+    verdict = next((status for status in STATUS_ORDER if counts.get(status)), None)
+    return {"verdict": verdict, "counts": counts}
+
+
+def sample_progress(run: Run, samples: List[str]) -> Dict[str, dict]:
+    """Task counts, latest status per process and QC verdict for every
+    sample of a run (`samples` lists those expected, e.g. from its sample sheet).
+    Verdicts of preview runs only cover a read subsample and are marked estimated."""
+    outdir = Path(run.outdir)
+    by_sample = sample_tasks(parse_trace(outdir / TRACE_FILE), samples)
+
+    progress = {}
+    for sample in sorted(set(samples) | set(by_sample)):
+        tasks = by_sample.get(sample, [])
+        qc = sample_qc(outdir, sample)
+        if qc is not None:
+            qc["estimated"] = run.stage == PREVIEW_STAGE
+        progress[sample] = {
+            "tasks": summarize_tasks(tasks),
+            "processes": {task["process"]: task.get("status") for task in tasks},
+            "qc": qc,
+        }
+    return progress
+
+
+# -------------------------------------------------
+# REUSE ACROSS ITERATIONS
+# -------------------------------------------------
+def reused_tasks(run: Run, earlier_runs: List[Run]) -> Dict[str, int]:
+    """Task name -> iteration that actually computed it, for every task of
+    `run` that Nextflow took from the job's cache (status CACHED).
+
+    Tasks are matched on the trace `hash` column, which identifies a task's
+    script and inputs; the earliest iteration that completed it wins.
+    """
+    cached = [
+        task for task in parse_trace(Path(run.outdir) / TRACE_FILE)
+        if task.get("status") == "CACHED" and task.get("hash")
+    ]
+    if not cached:
+        return {}
+
+    origin: Dict[str, int] = {}
+    for earlier in sorted(earlier_runs, key=lambda r: r.iteration):
+        if earlier.iteration >= run.iteration:
+            continue
+        for task in parse_trace(Path(earlier.outdir) / TRACE_FILE):
+            if task.get("status") == "COMPLETED" and task.get("hash"):
+                origin.setdefault(task["hash"], earlier.iteration)
+
+    return {task["name"]: origin[task["hash"]] for task in cached if task["hash"] in origin}
+
+
+# -------------------------------------------------
+# RUN STATUS
+# -------------------------------------------------
+def run_status(run: Run, queue_position: Optional[int] = None,
+               reused: Optional[Dict[str, int]] = None) -> dict:
+    """Scheduler state, exit code and per-process trace status of a run"""
+    tasks = parse_trace(Path(run.outdir) / TRACE_FILE)
+    reused = reused or {}
+    return {
+        "job_id": run.job_id,
+        "iteration": run.iteration,
+        "stage": run.stage,
+        "state": run.state,
+        "queue_position": queue_position,
+        "exit_code": run.exit_code,
+        "started_at": run.started_at.isoformat() if run.started_at else None,
+        "finished_at": run.finished_at.isoformat() if run.finished_at else None,
+        "processes": summarize_tasks(tasks),
+        "reused": reused,
+        "tasks": [
+            {
+                "name": task.get("name"),
+                "status": task.get("status"),
+                "exit": task.get("exit"),
+                "duration": task.get("duration"),
+                "reused_from": reused.get(task.get("name")),
+            }
+            for task in tasks
+        ],
+    }
@@ -0,0 +1,323 @@
+import json
+import os
+import subprocess
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Optional
+
+import psutil
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import Run, SessionLocal
+
+# -------------------------------------------------
+# CONFIGURATION
+# -------------------------------------------------
+# Maximum number of `nextflow run` processes across all API workers
+MAX_CONCURRENT_RUNS = int(os.getenv("PIPELINE_MAX_CONCURRENT_RUNS", "1"))
+# Preview runs (see PREVIEW_STAGE) allowed next to them
+MAX_PREVIEW_RUNS = int(os.getenv("PIPELINE_MAX_PREVIEW_RUNS", "1"))
+# Seconds between scheduler passes when nothing wakes it up earlier
+POLL_INTERVAL = float(os.getenv("PIPELINE_SCHEDULER_POLL_INTERVAL", "2"))
+# Seconds a claimed run may go without a pid before it counts as lost (the
+# worker that claimed it died between claiming and starting nextflow)
+LAUNCH_GRACE = float(os.getenv("PIPELINE_LAUNCH_GRACE", "60"))
+
+# Run states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# Nextflow's exit status, written to the run's outdir by main.nf's onComplete
+# handler; how a worker settles a run whose process it did not start
+EXIT_STATUS_FILE = "exit_status.txt"
+
+# Quick QC of a read subsample, run in its own Nextflow session next to the
+# job's full runs: previews have their own slots and never wait for (or
+# block) a full run
+PREVIEW_STAGE = "preview"
+
+
+# -------------------------------------------------
+# HELPERS
+# -------------------------------------------------
+def queue_order():
+    """Highest priority first, then first come first served"""
+    return (Run.priority.desc(), Run.created_at, Run.job_id, Run.iteration)
+
+
+def queued_runs(db: Session):
+    return db.query(Run).filter(Run.state == QUEUED).order_by(*queue_order()).all()
+
+
+def queue_position(db: Session, run: Run) -> Optional[int]:
+    """1-based position of a queued run, or None if it is no longer queued"""
+    if run.state != QUEUED:
+        return None
+    keys = [(r.job_id, r.iteration) for r in queued_runs(db)]
+    try:
+        return keys.index((run.job_id, run.iteration)) + 1
+    except ValueError:
+        return None
+
+
+def recorded_exit_code(run: Run) -> Optional[int]:
+    """Exit status nextflow recorded for a run, or None if it never got to
+    (killed, or still running)"""
+    try:
+        return int((Path(run.outdir) / EXIT_STATUS_FILE).read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def terminate_tree(pid: int, timeout: float = 10) -> None:
+    """Terminate a process and its children (nextflow's JVM and task shells)"""
+    try:
+        parent = psutil.Process(pid)
+    except psutil.NoSuchProcess:
+        return
+    procs = parent.children(recursive=True) + [parent]
+    for proc in procs:
+        try:
+            proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(procs, timeout=timeout)
+    for proc in alive:
+        try:
+            proc.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+
+# -------------------------------------------------
+# SCHEDULER
+# -------------------------------------------------
+class PipelineScheduler:
+    """Admission control for pipeline runs.
+
+    Runs are queued as rows in the `runs` table, so every API worker sees the
+    same queue. Each worker runs a background thread that starts queued runs
+    while fewer than `max_concurrent` are running, and reaps the processes it
+    started itself. Claiming a run is a single conditional UPDATE, which SQLite
+    serializes, so the limit holds across workers.
+
+    Iterations of one job share a Nextflow session (launch dir and work dir),
+    which Nextflow locks, so at most one run per job is running at a time.
+    Preview runs are admitted the same way in a lane of their own, limited
+    by `max_previews`.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_RUNS,
+                 poll_interval: float = POLL_INTERVAL, cwd: Optional[str] = None,
+                 max_previews: int = MAX_PREVIEW_RUNS,
+                 on_finish: Optional[Callable[[str, int], None]] = None,
+                 launch_grace: float = LAUNCH_GRACE):
+        self.max_concurrent = max_concurrent
+        self.launch_grace = launch_grace
+        self.max_previews = max_previews
+        # Called with (job_id, iteration) once a run started here is done or failed
+        self.on_finish = on_finish
+        self.poll_interval = poll_interval
+        self.cwd = cwd
+        self._procs = {}  # (job_id, iteration) -> Popen, for runs started here
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- lifecycle ----------
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="pipeline-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval + 5)
+
+    def wake(self) -> None:
+        """Run a scheduling pass now (after a submit, cancel or finish)"""
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Scheduler pass failed: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def tick(self) -> None:
+        with self._lock:
+            self._reap()
+            self._dispatch()
+
+    # ---------- state transitions ----------
+    def _finish(self, db: Session, job_id: str, iteration: int, state: str,
+                exit_code: Optional[int] = None, pid: Optional[int] = None,
+                unlaunched: bool = False) -> bool:
+        # Only running runs move to done/failed; a cancel, or another worker
+        # that settled the run first, wins. The row must also still hold `pid`,
+        # or no pid at all when `unlaunched`.
+        query = db.query(Run).filter(Run.job_id == job_id, Run.iteration == iteration, Run.state == RUNNING)
+        if pid is not None:
+            query = query.filter(Run.pid == pid)
+        elif unlaunched:
+            query = query.filter(Run.pid.is_(None))
+        changed = query.update(
+            {Run.state: state, Run.finished_at: datetime.utcnow(), Run.exit_code: exit_code},
+            synchronize_session=False
+        )
+        db.commit()
+        if changed and self.on_finish:
+            try:
+                self.on_finish(job_id, iteration)
+            except Exception as e:
+                print(f"Finish hook failed for run {job_id}/{iteration}: {e}")
+        return bool(changed)
+
+    def _reap(self) -> None:
+        db = SessionLocal()
+        try:
+            for key, proc in list(self._procs.items()):
+                # poll() never blocks and reaps the child, so no zombies are left
+                returncode = proc.poll()
+                if returncode is None:
+                    continue
+                del self._procs[key]
+                self._finish(db, *key, DONE if returncode == 0 else FAILED, returncode)
+
+            # Runs this worker does not own whose process is gone: reaped by
+            # the worker that started it (which is about to record the outcome)
+            # or left behind by a worker that has since died. Either way the
+            # outcome is the exit status nextflow recorded, not the missing pid.
+            owned = set(self._procs)
+            launch_deadline = datetime.utcnow() - timedelta(seconds=self.launch_grace)
+            for run in db.query(Run).filter(Run.state == RUNNING).all():
+                if (run.job_id, run.iteration) in owned:
+                    continue
+                if run.pid is not None:
+                    if psutil.pid_exists(run.pid):
+                        continue
+                    exit_code = recorded_exit_code(run)
+                    state = DONE if exit_code == 0 else FAILED
+                    self._finish(db, run.job_id, run.iteration, state, exit_code, pid=run.pid)
+                elif run.started_at is None or run.started_at < launch_deadline:
+                    # Claimed but never launched: the claiming worker died
+                    self._finish(db, run.job_id, run.iteration, FAILED, unlaunched=True)
+        finally:
+            db.close()
+
+    def _limit(self, run: Run) -> int:
+        return self.max_previews if run.stage == PREVIEW_STAGE else self.max_concurrent
+
+    def _claim(self, db: Session, run: Run) -> bool:
+        # Runs only compete with runs of their own lane (preview or not)
+        lane = "(stage = :preview) = :is_preview"
+        claimed = db.execute(
+            text(
+                "UPDATE runs SET state = :running, started_at = :now "
+                "WHERE job_id = :job_id AND iteration = :iteration AND state = :queued "
+                f"AND (SELECT COUNT(*) FROM runs WHERE state = :running AND {lane}) < :limit "
+                f"AND NOT EXISTS (SELECT 1 FROM runs WHERE job_id = :job_id AND state = :running AND {lane})"
+            ),
+            {
+                "running": RUNNING, "queued": QUEUED, "now": datetime.utcnow(),
+                "job_id": run.job_id, "iteration": run.iteration, "limit": self._limit(run),
+                "preview": PREVIEW_STAGE, "is_preview": int(run.stage == PREVIEW_STAGE),
+            },
+        ).rowcount
+        db.commit()
+        return claimed == 1
+
+    def _launch(self, db: Session, run: Run) -> None:
+        db.refresh(run)
+        if run.state != RUNNING:
+            return  # Cancelled since we claimed it
+
+        try:
+            with open(run.log, "a") as log:
+                proc = subprocess.Popen(
+                    json.loads(run.command),
+                    cwd=run.launch_dir or self.cwd,
+                    stdout=log,
+                    stderr=subprocess.STDOUT
+                )
+        except Exception as e:
+            print(f"Failed to start run {run.job_id}/{run.iteration}: {e}")
+            self._finish(db, run.job_id, run.iteration, FAILED, unlaunched=True)
+            return
+
+        # Record the pid only if the run is still ours to start: a cancel from
+        # another worker may have landed while nextflow was being spawned
+        recorded = db.query(Run).filter(
+            Run.job_id == run.job_id, Run.iteration == run.iteration,
+            Run.state == RUNNING, Run.pid.is_(None)
+        ).update({Run.pid: proc.pid}, synchronize_session=False)
+        db.commit()
+        if not recorded:
+            terminate_tree(proc.pid)
+            proc.wait()
+            return
+        self._procs[(run.job_id, run.iteration)] = proc
+
+    def _dispatch(self) -> None:
+        db = SessionLocal()
+        try:
+            while True:
+                running = db.query(Run).filter(Run.state == RUNNING).all()
+                queue = [r for r in queued_runs(db) if self._admissible(r, running)]
+                if not queue:
+                    return
+                run = queue[0]
+                if self._claim(db, run):
+                    self._launch(db, run)
+                else:
+                    # Another worker claimed it or filled the last slot; re-check
+                    db.expire_all()
+        finally:
+            db.close()
+
+    def _admissible(self, run: Run, running) -> bool:
+        """A free slot in the run's lane and no running run of its job there"""
+        lane = [r for r in running if (r.stage == PREVIEW_STAGE) == (run.stage == PREVIEW_STAGE)]
+        return len(lane) < self._limit(run) and all(r.job_id != run.job_id for r in lane)
+
+    # ---------- cancellation ----------
+    def cancel(self, db: Session, run: Run) -> bool:
+        """Cancel a queued or running run. Returns False if it already finished."""
+        with self._lock:
+            # Conditional, like _claim and _finish: a run another worker
+            # settled in the meantime keeps its outcome
+            cancelled = db.query(Run).filter(
+                Run.job_id == run.job_id, Run.iteration == run.iteration,
+                Run.state.in_((QUEUED, RUNNING))
+            ).update({Run.state: CANCELLED, Run.finished_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            db.refresh(run)
+            if not cancelled:
+                return False
+
+            # A run claimed but not launched yet has no pid: _launch sees the
+            # cancel and stops nextflow itself
+            if run.pid:
+                terminate_tree(run.pid)
+                proc = self._procs.pop((run.job_id, run.iteration), None)
+                if proc:
+                    run.exit_code = proc.wait()
+                    db.commit()
+
+        self.wake()
+        return True
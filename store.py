@@ -0,0 +1,248 @@
+import glob
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import Blob, BlobRef, Run
+from scheduler import FINISHED_STATES
+
+
+def expand_braces(pattern: str) -> List[str]:
+    """Expand Nextflow-style {a,b} alternatives, e.g. s_{1,2}.fastq.gz"""
+    match = re.search(r"\{([^{}]*)\}", pattern)
+    if not match:
+        return [pattern]
+    expanded = []
+    for option in match.group(1).split(","):
+        expanded.extend(expand_braces(pattern[:match.start()] + option + pattern[match.end():]))
+    return expanded
+
+
+def expand_pattern(pattern: str) -> List[str]:
+    """Files matched by a reads pattern (braces and globs)"""
+    files = set()
+    for candidate in expand_braces(pattern):
+        files.update(glob.glob(candidate))
+    return sorted(files)
+
+
+class BlobStore:
+    """Content-addressed store for uploaded reads and references.
+
+    Each distinct file is kept once, as store/blobs/<sha[:2]>/<sha>. Readable
+    names (data_test/<sample>_1.fastq.gz, ref_test/<name>) are hardlinks to
+    their blob, or symlinks when the store is on another filesystem. The
+    blob_refs table counts who uses each blob: a name, or a run pin made when
+    a run is submitted. Runs read their inputs from store/inputs/<key>/, where
+    the key is derived from the content, so re-uploading a name never changes
+    the files of a queued or running job. gc() drops blobs nothing refers to.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.inputs_dir = os.path.join(root, "inputs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.inputs_dir, exist_ok=True)
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    @staticmethod
+    def _stage_link(src: str, dest: str) -> str:
+        """A new link to `src` next to `dest`: a hardlink, or a symlink across filesystems"""
+        tmp = f"{dest}.link-{uuid.uuid4().hex}"
+        try:
+            os.link(src, tmp)
+        except OSError:
+            os.symlink(os.path.abspath(src), tmp)
+        return tmp
+
+    @classmethod
+    def link(cls, src: str, dest: str) -> None:
+        """Atomically point `dest` at `src`"""
+        os.replace(cls._stage_link(src, dest), dest)
+
+    @staticmethod
+    def _move(src: str, dest: str) -> None:
+        try:
+            os.replace(src, dest)
+        except OSError:
+            shutil.move(src, dest)  # Store on another filesystem
+
+    def _set_ref(self, db: Session, ref: str, sha256: str,
+                 job_id: Optional[str] = None, iteration: Optional[int] = None) -> None:
+        db.merge(BlobRef(ref=ref, sha256=sha256, job_id=job_id, iteration=iteration))
+
+    def _stored_blob(self, db: Session, sha256: str) -> Optional[Blob]:
+        blob = db.get(Blob, sha256)
+        if blob is not None and os.path.exists(blob.path):
+            return blob
+        return None
+
+    # ---------- ingest ----------
+    def adopt(self, db: Session, path: str, sha256: str, dest: Optional[str] = None) -> dict:
+        """Take a freshly written file at `path` into the store and leave a link
+        to its blob at `dest` (default: `path`). If the content is already
+        stored the new copy is dropped, so identical uploads take no extra disk."""
+        return self.adopt_all(db, [(path, sha256, dest)])[0]
+
+    def adopt_all(self, db: Session, files: List[Tuple[str, str, Optional[str]]]) -> List[dict]:
+        """adopt() several (path, sha256, dest) files as one unit, e.g. both mates
+        of a pair. The refs are committed before any name is switched to its
+        new blob, and the names are only switched once the commit succeeded, so
+        a name and its ref never disagree. On failure the refs are rolled back,
+        every name is left alone and every `path` is put back where it was."""
+        moved = []   # (blob_path, path) moved into the store by this call
+        links = []   # (staged link, dest)
+        dropped = []  # Duplicates of stored content, removed once committed
+        results = []
+        try:
+            for path, sha256, dest in files:
+                path = os.path.abspath(path)
+                dest = os.path.abspath(dest or path)
+                blob = self._stored_blob(db, sha256)
+                deduplicated = blob is not None
+
+                if blob is None:
+                    blob_path = self.blob_path(sha256)
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    self._move(path, blob_path)
+                    moved.append((blob_path, path))
+                    os.chmod(blob_path, 0o444)  # Blobs are immutable
+                    blob = db.merge(Blob(sha256=sha256, path=blob_path, size=os.path.getsize(blob_path)))
+                elif path != dest:
+                    dropped.append(path)
+
+                links.append((self._stage_link(blob.path, dest), dest))
+                self._set_ref(db, dest, sha256)
+                results.append({"sha256": sha256, "size": blob.size, "deduplicated": deduplicated})
+            db.commit()
+        except BaseException:
+            db.rollback()
+            for tmp, _ in links:
+                os.remove(tmp)
+            for blob_path, path in reversed(moved):
+                os.chmod(blob_path, 0o644)
+                self._move(blob_path, path)
+            raise
+
+        for tmp, dest in links:
+            os.replace(tmp, dest)
+        for path in dropped:
+            os.remove(path)
+        return results
+
+    def sha_of(self, db: Session, path: str) -> Optional[str]:
+        ref = db.get(BlobRef, os.path.abspath(path))
+        return ref.sha256 if ref else None
+
+    # ---------- run pins ----------
+    def _pin(self, db: Session, files: List[str], job_id: str, iteration: int) -> Optional[str]:
+        shas = [self.sha_of(db, f) for f in files]
+        if not files or not all(shas):
+            return None  # Not (entirely) store-managed: leave the run on the original paths
+
+        key_source = "\n".join(sorted(f"{os.path.basename(f)}:{sha}" for f, sha in zip(files, shas)))
+        pin_dir = os.path.join(self.inputs_dir, hashlib.sha256(key_source.encode("utf-8")).hexdigest()[:32])
+        os.makedirs(pin_dir, exist_ok=True)
+
+        for f, sha in zip(files, shas):
+            target = os.path.join(pin_dir, os.path.basename(f))
+            if not os.path.exists(target):
+                self.link(self.blob_path(sha), target)
+            pin = os.path.relpath(target, self.inputs_dir)
+            self._set_ref(db, f"run:{job_id}:{iteration}:{pin}", sha, job_id, iteration)
+        return pin_dir
+
+    def pin_inputs(self, db: Session, job_id: str, iteration: int,
+                   reads_pattern: Optional[str], ref_path: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """Pin a run's reads and reference to their current content and return
+        the (reads_pattern, ref_path) the run should use instead."""
+        if reads_pattern:
+            pin_dir = self._pin(db, expand_pattern(reads_pattern), job_id, iteration)
+            if pin_dir:
+                reads_pattern = os.path.join(pin_dir, os.path.basename(reads_pattern))
+
+        if ref_path:
+            pin_dir = self._pin(db, [ref_path], job_id, iteration)
+            if pin_dir:
+                ref_path = os.path.join(pin_dir, os.path.basename(ref_path))
+
+        db.commit()
+        return reads_pattern, ref_path
+
+    def pin_files(self, db: Session, job_id: str, iteration: int, files: List[str]) -> List[str]:
+        """Pin a group of files (e.g. one sample's mates) and return their pinned
+        paths; files outside the store are returned unchanged."""
+        pin_dir = self._pin(db, files, job_id, iteration)
+        db.commit()
+        if not pin_dir:
+            return files
+        return [os.path.join(pin_dir, os.path.basename(f)) for f in files]
+
+    # ---------- garbage collection ----------
+    def stats(self, db: Session) -> dict:
+        blobs = db.query(Blob).all()
+        referenced = {ref.sha256 for ref in db.query(BlobRef).all()}
+        return {
+            "blobs": len(blobs),
+            "bytes": sum(blob.size for blob in blobs),
+            "referenced": sum(1 for blob in blobs if blob.sha256 in referenced),
+            "unreferenced": sum(1 for blob in blobs if blob.sha256 not in referenced),
+        }
+
+    def gc(self, db: Session) -> dict:
+        """Release pins of finished runs, delete blobs with no references left
+        and the run input links that still point at them."""
+        finished = {
+            (job_id, iteration)
+            for job_id, iteration in db.query(Run.job_id, Run.iteration).filter(Run.state.in_(FINISHED_STATES))
+        }
+        live = set()
+        for ref in db.query(BlobRef).all():
+            if ref.job_id is not None and (ref.job_id, ref.iteration) in finished:
+                db.delete(ref)
+            else:
+                live.add(ref.sha256)
+
+        removed = 0
+        freed = 0
+        live_inodes = set()
+        for blob in db.query(Blob).all():
+            if blob.sha256 in live:
+                try:
+                    st = os.stat(blob.path)
+                    live_inodes.add((st.st_dev, st.st_ino))
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                os.remove(blob.path)
+            except FileNotFoundError:
+                pass
+            db.delete(blob)
+            removed += 1
+            freed += blob.size
+        db.commit()
+
+        # Hardlinks in store/inputs would keep deleted blobs' data alive
+        for root, dirs, files in os.walk(self.inputs_dir, topdown=False):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                    stale = (st.st_dev, st.st_ino) not in live_inodes
+                except FileNotFoundError:
+                    stale = True  # Dangling symlink
+                if stale:
+                    os.remove(path)
+            if root != self.inputs_dir and not os.listdir(root):
+                os.rmdir(root)
+
+        return {"removed": removed, "freed_bytes": freed}
@@ -2,6 +2,19 @@ import os
 import json
 import math
 import sys
+import argparse
+import hashlib
+import csv
+import re
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+try:
+    import numpy as np
+except ImportError:  # run_qc falls back to the pure-Python QCEvaluator
+    np = None
 
 # ======================================================
 # 1. QC RULES & THRESHOLDS
@@ -95,16 +108,117 @@ QC_RULES = {
     }
 }
 
+# FastQC modules each rule reads from. Used by the streaming parser to skip
+# modules no rule asks for.
+METRIC_MODULES = {
+    "basic_statistics": ("Basic Statistics",),
+    "per_base_sequence_quality": ("Per base sequence quality",),
+    "per_sequence_quality_scores": ("Per sequence quality scores",),
+    "per_base_sequence_content": ("Per base sequence content",),
+    "per_base_gc_content": ("Per base sequence content", "Basic Statistics"),
+    "per_sequence_gc_content": ("Per sequence GC content",),
+    "per_base_n_content": ("Per base N content",),
+    "sequence_length_distribution": ("Sequence Length Distribution",),
+    "duplicate_sequences": ("Sequence Duplication Levels",),
+    "overrepresented_sequences": ("Overrepresented sequences",),
+    "overrepresented_kmers": ("Kmer Content",),
+}
+
+# Columns the streaming parser decodes per module:
+# (column index, column name, array typecode or None for text, required)
+# Rows missing a required column or failing conversion are dropped, the same
+# rows get_metric skips when parsing from strings.
+MODULE_COLUMNS = {
+    "Basic Statistics": (
+        (0, "measure", None, True), (1, "value", None, True)),
+    "Per base sequence quality": (
+        (0, "base", None, True), (2, "median", "d", True), (3, "lower_quartile", "d", True)),
+    "Per sequence quality scores": (
+        (0, "quality", "l", True), (1, "count", "d", True)),
+    "Per base sequence content": (
+        (0, "base", None, True), (1, "G", "d", True), (2, "A", "d", True),
+        (3, "T", "d", True), (4, "C", "d", True)),
+    "Per sequence GC content": (),  # Only the module status is used
+    "Per base N content": (
+        (0, "base", None, True), (1, "n_content", "d", True)),
+    "Sequence Length Distribution": (
+        (0, "length", None, True), (1, "count", "d", True)),
+    "Sequence Duplication Levels": (),  # Only the Total Deduplicated Percentage header is used
+    "Overrepresented sequences": (
+        (0, "sequence", None, True), (2, "percentage", "d", True)),
+    "Kmer Content": (
+        (0, "sequence", None, True), (2, "p_value", "d", True), (3, "obs_exp_max", "d", False)),
+}
+
+# Metrics whose rows map one to one onto the decoded module columns
+TABLE_METRICS = {
+    "per_base_sequence_quality": "Per base sequence quality",
+    "per_sequence_quality_scores": "Per sequence quality scores",
+    "per_base_sequence_content": "Per base sequence content",
+    "per_base_n_content": "Per base N content",
+    "sequence_length_distribution": "Sequence Length Distribution",
+    "overrepresented_sequences": "Overrepresented sequences",
+}
+
+
+def required_modules(rules):
+    """Return the set of FastQC module names needed to evaluate `rules`."""
+    modules = set()
+    for key in rules:
+        modules.update(METRIC_MODULES.get(key, ()))
+    return modules
+
+
+def _number(raw):
+    # Basic Statistics values are text; keep numbers typed for the cohort table
+    if raw is None:
+        return None
+    for convert in (int, float):
+        try:
+            return convert(raw)
+        except ValueError:
+            pass
+    return raw
+
+
+def _convert(raw, typecode):
+    if typecode is None:
+        return raw
+    if typecode == "l":
+        return int(raw)
+    return float(raw)
+
+
+def _decode_row(parts, layout):
+    # Returns the typed values for one data row, or None if the row is unusable
+    values = []
+    for index, _, typecode, required in layout:
+        try:
+            values.append(_convert(parts[index], typecode))
+        except (IndexError, ValueError):
+            if required:
+                return None
+            values.append(math.nan)
+    return values
+
 # ======================================================
 # 2. PARSERS
 # ======================================================
 
 class FastQCParser:
-    def __init__(self, filepath):
+    def __init__(self, filepath, streaming=False, rules=None):
         self.filepath = filepath
         self.data = {}
         self.modules = {}
-        self.parse()
+        self.columns = {}
+        self.metric_cache = {}
+        self.streaming = streaming
+        # Modules to decode in streaming mode; None keeps every known module
+        self.wanted = required_modules(rules) if rules is not None else None
+        if streaming:
+            self.parse_streaming()
+        else:
+            self.parse()
 
     def parse(self):
         try:
@@ -146,7 +260,195 @@ class FastQCParser:
             else:
                 module_data.append(line.split('\t'))
 
+    def parse_streaming(self):
+        """Walk the report line by line, decoding each wanted module straight
+        into typed columns (`array` of float/int, lists for text)."""
+        try:
+            f = open(self.filepath, 'r')
+        except Exception as e:
+            print(f"Error reading {self.filepath}: {e}")
+            return
+
+        current_module = None
+        current_status = None
+        layout = ()
+        columns = {}
+
+        with f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+
+                if line.startswith(">>"):
+                    if line == ">>END_MODULE":
+                        if current_module:
+                            self.columns[current_module] = {
+                                "status": current_status,
+                                "columns": columns
+                            }
+                        current_module = None
+                        layout = ()
+                        columns = {}
+                    else:
+                        parts = line.split('\t')
+                        name = parts[0][2:]
+                        if name not in MODULE_COLUMNS or (self.wanted is not None and name not in self.wanted):
+                            # Skip the module body entirely
+                            current_module = None
+                            continue
+                        current_module = name
+                        current_status = parts[1] if len(parts) > 1 else "pass"
+                        layout = MODULE_COLUMNS[name]
+                        columns = {
+                            col_name: [] if typecode is None else array(typecode)
+                            for _, col_name, typecode, _ in layout
+                        }
+                elif current_module is None:
+                    continue
+                elif line.startswith("#"):
+                    if current_module == "Sequence Duplication Levels" and "Total Deduplicated Percentage" in line:
+                        parts = line.split('\t')
+                        if len(parts) >= 2:
+                            self.data["total_deduplicated_percentage"] = float(parts[1])
+                elif layout:
+                    values = _decode_row(line.split('\t'), layout)
+                    if values is None:
+                        continue
+                    for (_, col_name, _, _), value in zip(layout, values):
+                        columns[col_name].append(value)
+
+    def get_columns(self, module_name):
+        """Return the decoded columns of a module (streaming mode), or None."""
+        mod = self.columns.get(module_name)
+        if not mod:
+            return None
+        return mod["columns"]
+
+    def _get_streaming_metric(self, metric_key):
+        # Same shapes as get_metric, built from the typed columns
+        if metric_key in TABLE_METRICS:
+            columns = self.get_columns(TABLE_METRICS[metric_key])
+            if columns is None:
+                return [] if metric_key == "overrepresented_sequences" else None
+            names = list(columns.keys())
+            return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+        elif metric_key == "basic_statistics":
+            columns = self.get_columns("Basic Statistics")
+            if columns is None: return None
+            return dict(zip(columns["measure"], columns["value"]))
+
+        elif metric_key == "per_sequence_gc_content":
+            mod = self.columns.get("Per sequence GC content")
+            if not mod: return None
+            return {"status": mod["status"]}
+
+        elif metric_key == "overrepresented_kmers":
+            columns = self.get_columns("Kmer Content")
+            if columns is None: return []
+            # Mirrors get_metric: one entry for the PValue column, one for Obs/Exp Max
+            parsed = []
+            for seq, p_value, obs_exp in zip(columns["sequence"], columns["p_value"], columns["obs_exp_max"]):
+                parsed.append({"sequence": seq, "enrichment": p_value})
+                if not math.isnan(obs_exp):
+                    parsed.append({"sequence": seq, "enrichment": obs_exp})
+            return parsed
+
+        return None
+
     def get_metric(self, metric_key):
+        """Return the typed form of a metric. Each metric is decoded at most once
+        per parser; derived metrics reuse the cached forms they depend on."""
+        if metric_key not in self.metric_cache:
+            self.metric_cache[metric_key] = self._decode_metric(metric_key)
+        return self.metric_cache[metric_key]
+
+    def metrics(self, keys=QC_RULES):
+        """Return the whole metric bundle {key: metric} for `keys` in one pass."""
+        return {key: self.get_metric(key) for key in keys}
+
+    def summary_metrics(self):
+        """Scalar metrics reported per read file in the cohort table."""
+        stats = self.get_metric("basic_statistics") or {}
+        duplication = self.get_metric("duplicate_sequences") or {}
+        return {
+            "total_sequences": _number(stats.get("Total Sequences")),
+            "sequence_length": stats.get("Sequence length"),
+            "gc_percent": _number(stats.get("%GC")),
+            "duplication_rate": duplication.get("duplication_rate"),
+        }
+
+    def get_metric_columns(self, metric_key):
+        """Column form of a metric for VectorizedQCEvaluator: per-row tables
+        become {column: numpy array} (text columns stay lists), every other
+        metric is returned as from get_metric. Requires numpy; cached like
+        get_metric."""
+        cache_key = ("columns", metric_key)
+        if cache_key not in self.metric_cache:
+            self.metric_cache[cache_key] = self._decode_metric_columns(metric_key)
+        return self.metric_cache[cache_key]
+
+    def metric_columns(self, keys=QC_RULES):
+        """Column-form metric bundle {key: metric} for `keys`."""
+        return {key: self.get_metric_columns(key) for key in keys}
+
+    def _table_columns(self, module_name, metric_key):
+        if self.streaming:
+            columns = self.get_columns(module_name)
+            if columns is None:
+                return None
+            # array.array exposes its buffer, so numeric columns are not copied
+            return {
+                name: col if isinstance(col, list) else np.frombuffer(col, dtype=col.typecode)
+                for name, col in columns.items()
+            }
+        rows = self.get_metric(metric_key)
+        if rows is None:
+            return None
+        layout = MODULE_COLUMNS[module_name]
+        return {
+            name: [row[name] for row in rows] if typecode is None
+            else np.array([row[name] for row in rows], dtype=typecode)
+            for _, name, typecode, _ in layout
+        }
+
+    def _decode_metric_columns(self, metric_key):
+        if metric_key in TABLE_METRICS:
+            columns = self._table_columns(TABLE_METRICS[metric_key], metric_key)
+            if columns is None and metric_key == "overrepresented_sequences":
+                return {"sequence": [], "percentage": np.empty(0)}
+            return columns
+
+        elif metric_key == "per_base_gc_content":
+            content = self.get_metric_columns("per_base_sequence_content")
+            stats = self.get_metric("basic_statistics")
+            if not content or not len(content["base"]) or not stats: return None
+            try:
+                mean_gc = float(stats.get("%GC", 0))
+            except: return None
+            return {"base": content["base"], "gc": content["G"] + content["C"], "mean_gc": mean_gc}
+
+        elif metric_key == "overrepresented_kmers":
+            if self.streaming:
+                columns = self.get_columns("Kmer Content")
+                if columns is None:
+                    return {"enrichment": np.empty(0)}
+                # Same entries as get_metric: PValue and Obs/Exp Max per row
+                # (missing Obs/Exp values are NaN and never exceed a threshold)
+                return {"enrichment": np.concatenate([
+                    np.frombuffer(columns["p_value"], dtype="d"),
+                    np.frombuffer(columns["obs_exp_max"], dtype="d"),
+                ])}
+            kmers = self.get_metric(metric_key)
+            return {"enrichment": np.array([k["enrichment"] for k in kmers], dtype="d")}
+
+        return self.get_metric(metric_key)
+
+    def _decode_metric(self, metric_key):
+        if self.streaming and metric_key not in ("per_base_gc_content", "duplicate_sequences"):
+            return self._get_streaming_metric(metric_key)
+
         if metric_key == "basic_statistics":
             mod = self.modules.get("Basic Statistics")
             if not mod: return None
@@ -275,16 +577,152 @@ class FastQCParser:
 
         return None
 
+class FastpParser(FastQCParser):
+    """Metrics of one read ("read1" or "read2") of a fastp JSON report, from
+    its after-filtering statistics, in the same forms as FastQCParser.
+
+    fastp keeps no per-base quartiles, only a mean quality curve. A mean is
+    never below the lower quartile, so graded as one the per-base quality
+    rule would all but always pass: it comes out UNKNOWN, like the rules on
+    the per-sequence quality and GC histograms fastp does not have. There is
+    no length histogram either, only whether reads were shortened. Overrepresented sequences are only
+    there when fastp ran with -p. Its raw 5-mer counts are no Obs/Exp
+    enrichment, so the k-mer rule is UNKNOWN too."""
+
+    def __init__(self, filepath, read="read1"):
+        self.read = read
+        self.report = {}
+        self.stats = {}
+        super().__init__(filepath)
+
+    def parse(self):
+        try:
+            with open(self.filepath) as f:
+                self.report = json.load(f)
+        except Exception as e:
+            print(f"Error reading {self.filepath}: {e}")
+            return
+        self.stats = self.report.get(f"{self.read}_after_filtering") or {}
+
+    def _curve(self, group, key, scale=1.0):
+        curve = self.stats.get(group, {}).get(key)
+        if not curve:
+            return None
+        return [(str(i + 1), value * scale) for i, value in enumerate(curve)]
+
+    def _decode_metric_columns(self, metric_key):
+        # FastQC reports without the module had no overrepresented sequences;
+        # fastp simply did not look for them unless run with -p
+        if metric_key == "overrepresented_sequences" and self.get_metric(metric_key) is None:
+            return None
+        if metric_key == "overrepresented_kmers":
+            return None
+        return super()._decode_metric_columns(metric_key)
+
+    def _decode_metric(self, metric_key):
+        stats = self.stats
+        if not stats:
+            return None
+        total = stats.get("total_reads", 0)
+        cycles = stats.get("total_cycles", 0)
+        uniform = bool(total) and stats.get("total_bases", 0) == total * cycles
+
+        if metric_key == "basic_statistics":
+            after = self.report.get("summary", {}).get("after_filtering", {})
+            return {
+                "Filename": os.path.basename(self.filepath),
+                "Total Sequences": str(total),
+                "Sequence length": str(cycles) if uniform else f"up to {cycles}",
+                "%GC": str(round(after.get("gc_content", 0) * 100)),
+            }
+
+        elif metric_key == "per_base_sequence_content":
+            curves = [self._curve("content_curves", b, 100.0) for b in "GATC"]
+            if any(curve is None for curve in curves): return None
+            return [
+                {"base": g[0], "G": g[1], "A": a[1], "T": t[1], "C": c[1]}
+                for g, a, t, c in zip(*curves)
+            ]
+
+        elif metric_key == "per_base_n_content":
+            curve = self._curve("content_curves", "N", 100.0)
+            if curve is None: return None
+            return [{"base": base, "n_content": n} for base, n in curve]
+
+        elif metric_key == "sequence_length_distribution":
+            if not total: return None
+            rows = [{"length": str(cycles), "count": float(total)}]
+            if not uniform:
+                rows.insert(0, {"length": f"<{cycles}", "count": math.nan})
+            return rows
+
+        elif metric_key == "duplicate_sequences":
+            duplication = self.report.get("duplication")
+            if not duplication: return None
+            return {"duplication_rate": duplication.get("rate", 0) * 100}
+
+        elif metric_key == "overrepresented_sequences":
+            sequences = stats.get("overrepresented_sequences")
+            if sequences is None or not total: return None
+            return [
+                {"sequence": seq, "percentage": count / total * 100}
+                for seq, count in sequences.items()
+            ]
+
+        elif metric_key == "per_base_gc_content":
+            return super()._decode_metric(metric_key)
+
+        # per_base_sequence_quality (no quartiles), per_sequence_quality_scores,
+        # per_sequence_gc_content, overrepresented_kmers
+        return None
+
 # ======================================================
 # 3. EVALUATOR
 # ======================================================
 
 class QCEvaluator:
+    # Reasons for the per-position rules: (fail, warn, pass), the first two
+    # formatted with the number of failing / warning positions
+    COUNT_REASONS = {
+        "per_base_sequence_quality": (
+            "Low quality at {} positions. Thresholds: LQ < 5 or Med < 20.",
+            "Reduced quality at {} positions. Thresholds: LQ < 10 or Med < 25.",
+            "All bases passed quality thresholds."),
+        "per_base_sequence_content": (
+            "High base imbalance (>20%) at {} positions.",
+            "Moderate base imbalance (>10%) at {} positions.",
+            "Base content balance is within limits."),
+        "per_base_gc_content": (
+            "GC content deviates >10% from mean at {} positions.",
+            "GC content deviates >5% from mean at {} positions.",
+            "Per base GC content is consistent with mean."),
+        "per_base_n_content": (
+            "N content > 20% at {} positions.",
+            "N content > 5% at {} positions.",
+            "N content is low."),
+        "overrepresented_sequences": (
+            "Found {} sequences > 1% of total.",
+            "Found {} sequences > 0.1% of total.",
+            "No overrepresented sequences found."),
+        "overrepresented_kmers": (
+            "Found {} kmers enriched > 10-fold.",
+            "Found {} kmers enriched > 3-fold.",
+            "No highly enriched kmers found."),
+    }
+
     def __init__(self, metrics, rules):
         self.metrics = metrics
         self.rules = rules
         self.results = {}
 
+    def graded(self, key, n_fail, n_warn):
+        fail_reason, warn_reason, pass_reason = self.COUNT_REASONS[key]
+        if n_fail:
+            return {"status": "FAIL", "reason": fail_reason.format(int(n_fail))}
+        if n_warn:
+            return {"status": "WARN", "reason": warn_reason.format(int(n_warn))}
+        return {"status": "PASS", "reason": pass_reason}
+
     def evaluate(self):
         for key, rule in self.rules.items():
             data = self.metrics.get(key)
@@ -314,11 +752,7 @@ class QCEvaluator:
                 elif lq < thresholds["good"]["lower_quartile"] or med < thresholds["good"]["median"]:
                     warnings.append(f"Base {base} (LQ={lq}, Med={med})")
             
-            if failures:
-                return {"status": "FAIL", "reason": f"Low quality at {len(failures)} positions. Thresholds: LQ < 5 or Med < 20."}
-            if warnings:
-                return {"status": "WARN", "reason": f"Reduced quality at {len(warnings)} positions. Thresholds: LQ < 10 or Med < 25."}
-            return {"status": "PASS", "reason": "All bases passed quality thresholds."}
+            return self.graded(key, len(failures), len(warnings))
 
         elif key == "per_sequence_quality_scores":
             # Find peak
@@ -348,11 +782,7 @@ class QCEvaluator:
                 elif diff_at > thresholds["warn"]["diff"] or diff_gc > thresholds["warn"]["diff"]:
                     warnings.append(f"Base {base} (Diff > 10%)")
             
-            if failures:
-                return {"status": "FAIL", "reason": f"High base imbalance (>20%) at {len(failures)} positions."}
-            if warnings:
-                return {"status": "WARN", "reason": f"Moderate base imbalance (>10%) at {len(warnings)} positions."}
-            return {"status": "PASS", "reason": "Base content balance is within limits."}
+            return self.graded(key, len(failures), len(warnings))
 
         elif key == "per_base_gc_content":
             failures = []
@@ -366,11 +796,7 @@ class QCEvaluator:
                 elif dev > thresholds["good"]["deviation"]:
                     warnings.append(f"Base {base} (Dev > 5%)")
             
-            if failures:
-                return {"status": "FAIL", "reason": f"GC content deviates >10% from mean at {len(failures)} positions."}
-            if warnings:
-                return {"status": "WARN", "reason": f"GC content deviates >5% from mean at {len(warnings)} positions."}
-            return {"status": "PASS", "reason": "Per base GC content is consistent with mean."}
+            return self.graded(key, len(failures), len(warnings))
 
         elif key == "per_sequence_gc_content":
             # If we have status from tool
@@ -394,11 +820,7 @@ class QCEvaluator:
                 elif n > thresholds["warn"]["n_content"]:
                     warnings.append(f"Base {base} (N={n:.1f}%)")
             
-            if failures:
-                return {"status": "FAIL", "reason": f"N content > 20% at {len(failures)} positions."}
-            if warnings:
-                return {"status": "WARN", "reason": f"N content > 5% at {len(warnings)} positions."}
-            return {"status": "PASS", "reason": "N content is low."}
+            return self.graded(key, len(failures), len(warnings))
 
         elif key == "sequence_length_distribution":
             lengths = set(d["length"] for d in data)
@@ -428,11 +850,7 @@ class QCEvaluator:
                 elif pct > thresholds["good"]["percent"]:
                     warnings.append(f"{pct:.2f}%")
             
-            if failures:
-                return {"status": "FAIL", "reason": f"Found {len(failures)} sequences > 1% of total."}
-            if warnings:
-                return {"status": "WARN", "reason": f"Found {len(warnings)} sequences > 0.1% of total."}
-            return {"status": "PASS", "reason": "No overrepresented sequences found."}
+            return self.graded(key, len(failures), len(warnings))
 
         elif key == "overrepresented_kmers":
             failures = []
@@ -444,36 +862,180 @@ class QCEvaluator:
                 elif enr > thresholds["good"]["enrichment"]:
                     warnings.append(f"{enr:.1f}x")
             
-            if failures:
-                return {"status": "FAIL", "reason": f"Found {len(failures)} kmers enriched > 10-fold."}
-            if warnings:
-                return {"status": "WARN", "reason": f"Found {len(warnings)} kmers enriched > 3-fold."}
-            return {"status": "PASS", "reason": "No highly enriched kmers found."}
+            return self.graded(key, len(failures), len(warnings))
 
         return {"status": "UNKNOWN", "reason": "Rule not implemented"}
 
+class VectorizedQCEvaluator(QCEvaluator):
+    """QCEvaluator over column-form metrics (FastQCParser.metric_columns).
+    Per-position rules are counted with NumPy array comparisons instead of a
+    Python loop; statuses, counts and reasons match QCEvaluator."""
+
+    def check_rule(self, key, data, rule):
+        if data is None:
+            return {"status": "UNKNOWN", "reason": "Data not available in report"}
+
+        thresholds = rule["thresholds"]
+
+        if key == "per_base_sequence_quality":
+            lq = data["lower_quartile"]
+            med = data["median"]
+            fail = (lq < thresholds["bad"]["lower_quartile"]) | (med < thresholds["bad"]["median"])
+            warn = ~fail & ((lq < thresholds["good"]["lower_quartile"]) | (med < thresholds["good"]["median"]))
+            return self.graded(key, np.count_nonzero(fail), np.count_nonzero(warn))
+
+        elif key == "per_sequence_quality_scores":
+            counts = data["count"]
+            # nanargmax picks the first peak and skips NaN counts, like the
+            # strict > scan in QCEvaluator; with no counts at all the peak is
+            # -1. The scalar rule is then applied to that single peak row
+            finite = ~np.isnan(counts)
+            peak_qual = int(data["quality"][np.nanargmax(counts)]) if finite.any() else -1
+            return super().check_rule(key, [{"quality": peak_qual, "count": 0.0}], rule)
+
+        elif key == "per_base_sequence_content":
+            diff_at = np.abs(data["A"] - data["T"])
+            diff_gc = np.abs(data["G"] - data["C"])
+            fail = (diff_at > thresholds["fail"]["diff"]) | (diff_gc > thresholds["fail"]["diff"])
+            warn = ~fail & ((diff_at > thresholds["warn"]["diff"]) | (diff_gc > thresholds["warn"]["diff"]))
+            return self.graded(key, np.count_nonzero(fail), np.count_nonzero(warn))
+
+        elif key == "per_base_gc_content":
+            dev = np.abs(data["gc"] - data["mean_gc"])
+            fail = dev > thresholds["fail"]["deviation"]
+            warn = ~fail & (dev > thresholds["good"]["deviation"])
+            return self.graded(key, np.count_nonzero(fail), np.count_nonzero(warn))
+
+        elif key == "per_base_n_content":
+            n = data["n_content"]
+            fail = n > thresholds["fail"]["n_content"]
+            warn = ~fail & (n > thresholds["warn"]["n_content"])
+            return self.graded(key, np.count_nonzero(fail), np.count_nonzero(warn))
+
+        elif key == "sequence_length_distribution":
+            return super().check_rule(key, [{"length": l} for l in set(data["length"])], rule)
+
+        elif key == "overrepresented_sequences":
+            pct = data["percentage"]
+            fail = pct > thresholds["bad"]["percent"]
+            warn = ~fail & (pct > thresholds["good"]["percent"])
+            return self.graded(key, np.count_nonzero(fail), np.count_nonzero(warn))
+
+        elif key == "overrepresented_kmers":
+            enr = data["enrichment"]
+            fail = enr > thresholds["bad"]["enrichment"]
+            warn = ~fail & (enr > thresholds["good"]["enrichment"])
+            return self.graded(key, np.count_nonzero(fail), np.count_nonzero(warn))
+
+        return super().check_rule(key, data, rule)
+
 # ======================================================
-# 4. MAIN
+# 4. RESULT CACHE
 # ======================================================
 
-def run_qc(search_dir="."):
-    output_dir = "qc_results"
-    os.makedirs(output_dir, exist_ok=True)
+def rules_fingerprint(rules):
+    """Stable hash of the rules and thresholds (plus the cache format version)."""
+    payload = json.dumps({"version": ResultCache.VERSION, "rules": rules}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    print(f"Searching for QC data in: {os.path.abspath(search_dir)}")
 
+class ResultCache:
+    """On-disk cache of rule evaluations, keyed by a SHA-256 of the report
+    content plus the rules fingerprint. Least recently used entries are evicted
+    once the cache directory grows past `max_bytes`; eviction also sweeps the
+    temp files of writers killed before their rename."""
+
+    # Bump when evaluation output changes for the same rules (e.g. reason text)
+    VERSION = 3
+    # Temp files older than this were left by a killed writer, not a live one
+    TMP_GRACE_SECONDS = 3600
+
+    def __init__(self, cache_dir, rules=QC_RULES, max_bytes=64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fingerprint = rules_fingerprint(rules)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, path, extra=""):
+        digest = hashlib.sha256(self.fingerprint.encode("utf-8"))
+        digest.update(extra.encode("utf-8"))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key):
+        entry = self._entry(key)
+        try:
+            with open(entry) as f:
+                results = json.load(f)
+            os.utime(entry, None)  # Mark as recently used
+        except (OSError, ValueError):
+            return None
+        return results
+
+    def put(self, key, results):
+        entry = self._entry(key)
+        # Write then rename so concurrent workers never read a partial entry
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(results, f)
+        os.replace(tmp, entry)
+
+    def evict(self):
+        entries = []
+        stale = time.time() - self.TMP_GRACE_SECONDS
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith((".json", ".tmp")):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+                if name.endswith(".tmp"):
+                    # Never renamed into place: count nothing, sweep once stale
+                    if st.st_mtime < stale:
+                        os.remove(path)
+                    continue
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def open_cache(cache_dir=None, max_mb=None):
+    """ResultCache from the arguments, else QC_SUMMARY_CACHE and
+    QC_SUMMARY_CACHE_MAX_MB (default 64). Returns None when no directory is set."""
+    cache_dir = cache_dir or os.environ.get("QC_SUMMARY_CACHE")
+    if not cache_dir:
+        return None
+    if max_mb is None:
+        max_mb = float(os.environ.get("QC_SUMMARY_CACHE_MAX_MB", 64))
+    return ResultCache(cache_dir, QC_RULES, int(max_mb * 1024 * 1024))
+
+# ======================================================
+# 5. MAIN
+# ======================================================
+
+def find_reports(search_dir="."):
+    """Walk `search_dir` and return [(path, report_name)] for every FastQC/Falco
+    data file, sorted by path so results come out in a stable order."""
+    reports = []
     for root, dirs, files in os.walk(search_dir, followlinks=True):
         for file in files:
-            metrics = None
-            parser = None
-            report_name = None
-            
             # Falco / FastQC - PRIMARY SOURCE FOR COMPLIANCE REPORT
             if (file.endswith("_data.txt") and "fastqc" in file) or (file.endswith("fastqc_data.txt")):
-                # This is the data file directly
-                print(f"Processing FastQC/Falco data: {file}")
-                parser = FastQCParser(os.path.join(root, file))
-                
                 # Determine original filename for report
                 # e.g. ecoli_1.fastq.gz_fastqc_data.txt -> ecoli_1.fastq.gz
                 report_name = file.replace("_fastqc_data.txt", "").replace("fastqc_data.txt", "unknown_sample")
@@ -481,28 +1043,283 @@ def run_qc(search_dir="."):
                     report_name += " (Trimmed)"
                 else:
                     report_name += " (Raw)"
-            
-            # Fastp JSON - SKIP COMPLIANCE REPORT (Incomplete metrics)
-            elif file.endswith("fastp.json"):
-                print(f"Skipping Fastp JSON for compliance report (incomplete metrics): {file}")
+                reports.append((os.path.join(root, file), report_name))
+
+    return sorted(reports)
+
+
+def find_fastp_reports(search_dir="."):
+    """Walk `search_dir` and return [(path, report_name, read)] for both reads
+    of every fastp JSON, named like the trimmed FASTQs fastp wrote, e.g.
+    ('x/ecoli.fastp.json', 'ecoli_R1.trimmed.fastq.gz (fastp)', 'read1').
+    The "(fastp)" stage keeps them apart from falco's "(Trimmed)" reports of
+    the same FASTQs, whose summary files would otherwise be overwritten."""
+    reports = []
+    for root, dirs, files in os.walk(search_dir, followlinks=True):
+        for file in files:
+            if not file.endswith("fastp.json"):
                 continue
-            
-            if parser:
-                # Extract all metrics
-                extracted_metrics = {}
-                for key in QC_RULES.keys():
-                    extracted_metrics[key] = parser.get_metric(key)
-                
-                # Evaluate
-                evaluator = QCEvaluator(extracted_metrics, QC_RULES)
-                results = evaluator.evaluate()
-                
+            path = os.path.join(root, file)
+            try:
+                with open(path) as f:
+                    report = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error reading {path}: {e}")
+                continue
+            sample = file[:-len(".fastp.json")]
+            command = report.get("command", "")
+            for n, read in ((1, "read1"), (2, "read2")):
+                if f"{read}_after_filtering" not in report:
+                    continue
+                out = re.search(rf"--out{n}[ =](\S+)", command)
+                name = os.path.basename(out.group(1)) if out else f"{sample}_R{n}.trimmed.fastq.gz"
+                reports.append((path, f"{name} (fastp)", read))
+    return sorted(reports)
+
+
+def evaluate_report(path, vectorized=True, cache=None, read=None):
+    """Parse and evaluate a single fastqc_data.txt, or one `read` of a fastp
+    JSON, reusing a cached evaluation when `cache` holds one. Module-level so
+    it can run in a worker process.
+    Returns {"results": rule outcomes, "metrics": summary metrics}."""
+    key = None
+    if cache is not None:
+        try:
+            key = cache.key(path, read or "")
+        except OSError:
+            key = None
+        if key is not None:
+            evaluation = cache.get(key)
+            if evaluation is not None:
+                return evaluation
+
+    if read is not None:
+        parser = FastpParser(path, read)
+    else:
+        parser = FastQCParser(path, streaming=True, rules=QC_RULES)
+    if vectorized and np is not None:
+        evaluator = VectorizedQCEvaluator(parser.metric_columns(QC_RULES), QC_RULES)
+    else:
+        evaluator = QCEvaluator(parser.metrics(QC_RULES), QC_RULES)
+    evaluation = {"results": evaluator.evaluate(), "metrics": parser.summary_metrics()}
+
+    if key is not None:
+        cache.put(key, evaluation)
+    return evaluation
+
+
+def evaluate_entry(entry, vectorized=True, cache=None):
+    """evaluate_report for a (path, read) pair, as mapped over by run_qc"""
+    path, read = entry
+    return evaluate_report(path, vectorized, cache, read)
+
+
+def cohort_index(report_name):
+    """(sample, read, stage) for a report name, using the same sample naming
+    as main.nf, e.g. 'ecoli_R1.trimmed.fastq.gz (Trimmed)' -> ('ecoli', 'R1', 'trimmed')
+    and 'ecoli_R1.preview.fastq.gz (Raw)' -> ('ecoli', 'R1', 'raw')."""
+    name, _, stage = report_name.rpartition(" (")
+    stage = stage.rstrip(")").lower()
+    name = re.sub(r"\.fastq(?:\.gz)?$", "", name)
+    name = re.sub(r"\.(?:trimmed|preview)$", "", name)
+    match = re.search(r"(?:_R?|-R?)(\d)(?:_\d+)?$", name)
+    if not match:
+        return name, "", stage
+    return name[:match.start()], f"R{match.group(1)}", stage
+
+
+def estimated_results(results):
+    """Rule outcomes marked as estimated, e.g. for a preview's read subsample"""
+    return {key: dict(outcome, estimated=True) for key, outcome in results.items()}
+
+
+def cohort_row(report_name, evaluation, estimated=False):
+    """Flatten one report's metrics and rule outcomes into a cohort table row.
+    Rows of `estimated` evaluations (a read subsample) say so in a column."""
+    sample, read, stage = cohort_index(report_name)
+    row = {"sample": sample, "read": read, "stage": stage, "report": report_name}
+    if estimated:
+        row["estimated"] = True
+    row.update(evaluation["metrics"])
+    for key, outcome in evaluation["results"].items():
+        row[f"{key}_status"] = outcome["status"]
+        row[f"{key}_reason"] = outcome["reason"]
+    return row
+
+
+def write_cohort(path, rows):
+    """Write all rows, indexed (sorted) by sample, stage and read, to a single
+    file. The format follows the extension: .parquet (needs pyarrow, else
+    written as .csv), .csv, anything else newline-delimited JSON. Returns the
+    path written."""
+    rows = sorted(rows, key=lambda row: (row["sample"], row["stage"], row["read"], row["report"]))
+
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            path = path[:-len(".parquet")] + ".csv"
+            print(f"pyarrow not available, writing cohort summary as CSV: {path}")
+        else:
+            pq.write_table(pa.Table.from_pylist(rows), path)
+            return path
+
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else ["sample", "read", "stage", "report"])
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row, separators=(",", ":")) + "\n")
+    return path
+
+
+def resolve_workers(workers=None):
+    """Worker count from the argument, else QC_SUMMARY_WORKERS (default 1).
+    0 or less means one worker per CPU."""
+    if workers is None:
+        workers = int(os.environ.get("QC_SUMMARY_WORKERS", 1))
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def read_sample_map(path):
+    """{entry name: sample} from a TSV of `sample<TAB>entry<TAB>entry...` lines,
+    naming the files/directories in the search directory that belong to each
+    sample (written by main.nf for an aggregated QC_SUMMARY_ALL)"""
+    samples = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > 1 and fields[0]:
+                for entry in fields[1:]:
+                    samples[entry] = fields[0]
+    return samples
+
+
+def report_sample(path, report_name, search_dir=".", sample_map=None):
+    """Sample a report belongs to: from `sample_map` by the top-level entry of
+    `search_dir` it was found in, else from its name as in cohort_index"""
+    if sample_map:
+        entry = os.path.relpath(path, search_dir).split(os.sep, 1)[0]
+        if entry in sample_map:
+            return sample_map[entry]
+    return cohort_index(report_name)[0]
+
+
+def write_sample_cohorts(template, rows):
+    """Write one cohort table per sample to `template` (with a {sample}
+    placeholder) from (sample, row) pairs; returns the paths written."""
+    by_sample = {}
+    for sample, row in rows:
+        by_sample.setdefault(sample, []).append(row)
+    return [write_cohort(template.format(sample=sample), sample_rows)
+            for sample, sample_rows in sorted(by_sample.items())]
+
+
+def run_qc(search_dir=".", vectorized=True, workers=None, cache_dir=None,
+           cohort_path=None, per_report=True, fastp=False,
+           sample_cohort=None, sample_map=None, estimated=False):
+    """Evaluate every report under `search_dir`. With `sample_cohort` (a path
+    with a {sample} placeholder), also write one cohort table per sample next
+    to the combined `cohort_path`, so a whole plate is summarised in one call.
+    With `estimated` (reports of a read subsample), every outcome written is
+    marked as estimated."""
+    output_dir = "qc_results"
+    os.makedirs(output_dir, exist_ok=True)
+    cache = open_cache(cache_dir)
+    cohort_rows = []
+    sample_rows = []
+
+    print(f"Searching for QC data in: {os.path.abspath(search_dir)}")
+
+    reports = [(path, report_name, None) for path, report_name in find_reports(search_dir)]
+    if fastp:
+        # Trimmed reads evaluated from fastp's after-filtering statistics
+        reports.extend(find_fastp_reports(search_dir))
+    entries = [(path, read) for path, _, read in reports]
+    workers = min(resolve_workers(workers), len(reports))
+
+    if workers > 1:
+        # Fan parsing and evaluation out; map() yields results in input order
+        pool = ProcessPoolExecutor(max_workers=workers)
+        evaluations = pool.map(
+            partial(evaluate_entry, vectorized=vectorized, cache=cache), entries,
+            chunksize=max(1, len(entries) // (workers * 4))
+        )
+    else:
+        pool = None
+        evaluations = (evaluate_entry(entry, vectorized, cache) for entry in entries)
+
+    try:
+        for (path, report_name, read), evaluation in zip(reports, evaluations):
+            if read is None:
+                print(f"Processing FastQC/Falco data: {os.path.basename(path)}")
+            else:
+                print(f"Processing fastp data: {os.path.basename(path)} ({read})")
+
+            if cohort_path or sample_cohort:
+                row = cohort_row(report_name, evaluation, estimated)
+                # The sample map, when given, names the sample in every table
+                row["sample"] = report_sample(path, report_name, search_dir, sample_map)
+                cohort_rows.append(row)
+                if sample_cohort:
+                    sample_rows.append((row["sample"], row))
+
+            if per_report:
                 # Save
                 # Use a clean filename
                 out_base = report_name.replace(" ", "_").replace("(", "").replace(")", "").replace("/", "_")
-                
+
+                results = estimated_results(evaluation["results"]) if estimated else evaluation["results"]
                 with open(os.path.join(output_dir, out_base + "_report.json"), "w") as f:
                     json.dump(results, f, indent=4)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    if cohort_path:
+        written = write_cohort(cohort_path, cohort_rows)
+        print(f"Wrote cohort summary for {len(cohort_rows)} reports: {written}")
+
+    if sample_cohort:
+        written = write_sample_cohorts(sample_cohort, sample_rows)
+        print(f"Wrote cohort summaries for {len(written)} samples")
+
+    if cache is not None:
+        cache.evict()
+
 
 if __name__ == "__main__":
-    run_qc(os.getcwd())
+    arg_parser = argparse.ArgumentParser(description="Evaluate FastQC/Falco reports against QC_RULES.")
+    arg_parser.add_argument("search_dir", nargs="?", default=os.getcwd(),
+                            help="Directory searched for *fastqc_data.txt (default: current directory)")
+    arg_parser.add_argument("-j", "--workers", type=int, default=None,
+                            help="Worker processes (default: $QC_SUMMARY_WORKERS or 1; 0 = one per CPU)")
+    arg_parser.add_argument("--cache-dir", default=None,
+                            help="Reuse evaluations of unchanged reports from this directory (default: $QC_SUMMARY_CACHE)")
+    arg_parser.add_argument("--cohort", default=None, metavar="PATH",
+                            help="Also write every report to one table (.jsonl, .csv or .parquet)")
+    arg_parser.add_argument("--no-reports", action="store_true",
+                            help="Skip the per-report JSON files in qc_results/")
+    arg_parser.add_argument("--fastp", action="store_true",
+                            help="Also evaluate *fastp.json after-filtering statistics as the trimmed reports")
+    arg_parser.add_argument("--sample-cohort", default=None, metavar="TEMPLATE",
+                            help="Also write one table per sample, e.g. '{sample}.qc_cohort.jsonl'")
+    arg_parser.add_argument("--samples", default=None, metavar="TSV",
+                            help="sample<TAB>entry... lines assigning the top-level entries of search_dir to samples "
+                                 "(default: samples are taken from the report names)")
+    arg_parser.add_argument("--estimated", action="store_true",
+                            help="Mark every outcome as estimated (reports of a read subsample, e.g. a preview)")
+    args = arg_parser.parse_args()
+
+    run_qc(args.search_dir, workers=args.workers, cache_dir=args.cache_dir,
+           cohort_path=args.cohort, per_report=not args.no_reports, fastp=args.fastp,
+           sample_cohort=args.sample_cohort,
+           sample_map=read_sample_map(args.samples) if args.samples else None,
+           estimated=args.estimated)
@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import os
+import uuid
+import zlib
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+# Bytes buffered before hashing/validating/writing in a worker thread
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Cap on inflated output held at once while validating gzip
+GZIP_OUTPUT_LIMIT = 1024 * 1024
+
+
+class UploadError(ValueError):
+    """The uploaded data is corrupt or does not match its checksum"""
+
+
+# -------------------------------------------------
+# GZIP VALIDATION
+# -------------------------------------------------
+class GzipValidator:
+    """Inflates a gzip stream incrementally and discards the output, only to
+    prove it is intact. Handles multi-member files (bgzip, pigz, cat *.gz)."""
+
+    def __init__(self):
+        self._inflater = zlib.decompressobj(wbits=31)
+        self._in_member = False
+        self.members = 0
+
+    def feed(self, data: bytes) -> None:
+        try:
+            while data:
+                self._in_member = True
+                self._inflater.decompress(data, GZIP_OUTPUT_LIMIT)
+                if self._inflater.eof:
+                    self.members += 1
+                    self._in_member = False
+                    data = self._inflater.unused_data
+                    self._inflater = zlib.decompressobj(wbits=31)
+                else:
+                    data = self._inflater.unconsumed_tail
+        except zlib.error as e:
+            raise UploadError(f"Invalid gzip data: {e}")
+
+    def close(self) -> None:
+        if self._in_member:
+            raise UploadError("Truncated gzip data")
+        if not self.members:
+            raise UploadError("Empty gzip data")
+
+
+# -------------------------------------------------
+# STREAMING WRITER
+# -------------------------------------------------
+class UploadSink:
+    """Writes a stream to a temp file next to `dest`, hashing and (optionally)
+    gzip-validating each chunk as it is written. commit() renames it into
+    place (or, staged, leaves it for the caller to move), so the data crosses
+    the filesystem exactly once."""
+
+    def __init__(self, dest: str, gzip_check: bool = True):
+        self.dest = dest
+        self.tmp = f"{dest}.part-{uuid.uuid4().hex}"
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        self._file = open(self.tmp, "wb")
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self._gzip = GzipValidator() if gzip_check else None
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self._md5.update(data)
+        self._sha256.update(data)
+        if self._gzip:
+            self._gzip.feed(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def commit(self, expected_sha256: Optional[str] = None, staged: bool = False) -> dict:
+        self._file.close()
+        if self._gzip:
+            self._gzip.close()
+        sha256 = self._sha256.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            raise UploadError(f"SHA-256 mismatch: expected {expected_sha256}, got {sha256}")
+        if not staged:
+            os.replace(self.tmp, self.dest)
+        return {
+            "path": self.tmp if staged else self.dest,
+            "size": self.size,
+            "md5": self._md5.hexdigest(),
+            "sha256": sha256,
+            "gzip_members": self._gzip.members if self._gzip else None,
+        }
+
+    def abort(self) -> None:
+        self._file.close()
+        discard(self.tmp)
+
+
+async def receive_stream(chunks: AsyncIterator[bytes], dest: str, gzip_check: bool = True,
+                         expected_sha256: Optional[str] = None, staged: bool = False) -> dict:
+    """Stream `chunks` into `dest`, returning its size, MD5 and SHA-256.
+    Raises UploadError (leaving `dest` untouched) on corrupt gzip or a checksum
+    mismatch. Disk and CPU work runs in the threadpool, so several uploads
+    (e.g. both mates) can proceed concurrently. With `staged`, the verified
+    file is left at a temp path next to `dest` (returned as "path") for the
+    caller to move into place, e.g. with BlobStore.adopt."""
+    sink = await run_in_threadpool(UploadSink, dest, gzip_check)
+    buffer = bytearray()
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await run_in_threadpool(sink.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(sink.write, bytes(buffer))
+        return await run_in_threadpool(sink.commit, expected_sha256, staged)
+    except BaseException:
+        await run_in_threadpool(sink.abort)
+        raise
+
+
+async def receive_staged(streams: List[Tuple[AsyncIterator[bytes], str]], gzip_check: bool = True) -> List[dict]:
+    """Receive several (chunks, dest) streams concurrently, all or nothing:
+    each is verified into a staged file next to its `dest` (see receive_stream)
+    and no `dest` is touched. If one fails, the others are cancelled and every
+    staged file is removed before the error is raised."""
+    tasks = [
+        asyncio.ensure_future(receive_stream(chunks, dest, gzip_check, staged=True))
+        for chunks, dest in streams
+    ]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # Cancelled receives abort their own sinks; finished ones left a staged file
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, dict):
+                await run_in_threadpool(discard, result["path"])
+        raise
+
+
+def discard(path: str) -> None:
+    """Remove a staged or partial upload, if it is still there"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def upload_chunks(upload: UploadFile) -> AsyncIterator[bytes]:
+    """Read an UploadFile in UPLOAD_CHUNK_SIZE pieces"""
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+# -------------------------------------------------
+# RESUMABLE (MULTIPART) UPLOADS
+# -------------------------------------------------
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+MAX_PART_SIZE = 512 * 1024 * 1024
+
+
+def part_count(size: int, part_size: int) -> int:
+    return max(1, -(-size // part_size))
+
+
+def part_length(size: int, part_size: int, part_number: int) -> int:
+    """Expected byte length of a 1-based part"""
+    start = (part_number - 1) * part_size
+    return max(0, min(part_size, size - start))
+
+
+def preallocate(path: str, size: int) -> None:
+    """Create `path` with `size` bytes reserved so parts can land at any offset"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        if hasattr(os, "posix_fallocate") and size:
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+async def receive_part(chunks: AsyncIterator[bytes], path: str, offset: int, length: int) -> str:
+    """Write one part at `offset` of a preallocated file, in place. Parts of the
+    same upload may be written concurrently. Returns the part's SHA-256."""
+    fd = await run_in_threadpool(os.open, path, os.O_WRONLY)
+    digest = hashlib.sha256()
+    written = 0
+
+    def flush(data: bytes) -> None:
+        digest.update(data)
+        os.pwrite(fd, data, offset + written)
+
+    try:
+        buffer = bytearray()
+        async for chunk in chunks:
+            buffer += chunk
+            if written + len(buffer) > length:
+                raise UploadError(f"Part is larger than the expected {length} bytes")
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await run_in_threadpool(flush, bytes(buffer))
+                written += len(buffer)
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(flush, bytes(buffer))
+            written += len(buffer)
+    finally:
+        await run_in_threadpool(os.close, fd)
+
+    if written != length:
+        raise UploadError(f"Part has {written} bytes, expected {length}")
+    return digest.hexdigest()
+
+
+def verify_file(path: str, gzip_check: bool = True) -> dict:
+    """One sequential pass over an assembled upload: size, MD5, SHA-256 and,
+    for gzip data, an integrity check. Raises UploadError if corrupt."""
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    validator = GzipValidator() if gzip_check else None
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            md5.update(chunk)
+            sha256.update(chunk)
+            if validator:
+                validator.feed(chunk)
+            size += len(chunk)
+    if validator:
+        validator.close()
+    return {
+        "size": size,
+        "md5": md5.hexdigest(),
+        "sha256": sha256.hexdigest(),
+        "gzip_members": validator.members if validator else None,
+    }